@@ -4,7 +4,12 @@
 
 import sys
 import json
+import math
 import time
+import sqlite3
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from aliyunsdkcore.acs_exception.exceptions import ClientException
 from aliyunsdkcore.acs_exception.exceptions import ServerException
 from aliyunsdkcore.client import AcsClient
@@ -13,10 +18,34 @@ from aliyunsdkcr.request.v20160607 import GetRepoListRequest
 from aliyunsdkcr.request.v20160607 import GetRepoTagsRequest
 from aliyunsdkcr.request.v20160607 import DeleteImageRequest
 
+import retention
+
 namespace = 'namespace-zt'
-times = 0
+# 并发翻页的线程数上限
+page_workers = 8
+# 列标签/删除两级线程池与限流重试次数，main() 中按命令行参数覆盖
+list_workers = 4
+delete_workers = 4
+delete_retries = 5
+# 本地标签快照，main() 中按命令行参数打开
+DEFAULT_SNAPSHOT = 'acr_snapshot.db'
+snapshot = None
+full_listing = False
+
+# 默认保留策略：merge/gray 各按构建号（标签第三段，如 app-merge-123）保留最新 30 个，其余标签不动
+DEFAULT_POLICY = [
+    {"name": "merge", "pattern": "merge", "keep": 30, "sort": "build", "build": r"^(?:[^-]*-){2}(\d+)(?:-|$)"},
+    {"name": "gray", "pattern": "gray", "keep": 30, "sort": "build", "build": r"^(?:[^-]*-){2}(\d+)(?:-|$)"},
+]
+policy = retention.Policy(DEFAULT_POLICY)
 
 apiClient = AcsClient('xxxxxx', 'xxxxxxxxxx', 'cn-shenzhen')
+# 全局 API 并发上限，翻页和删除共用
+api_slots = threading.BoundedSemaphore(16)
+
+def call_api(request):
+    with api_slots:
+        return apiClient.do_action_with_exception(request)
 
 def get_repo_list():
     request = GetRepoListRequest.GetRepoListRequest()
@@ -24,7 +53,7 @@ def get_repo_list():
     request.set_endpoint("cr.cn-shenzhen.aliyuncs.com")
 
     try:
-        response = apiClient.do_action_with_exception(request)
+        response = call_api(request)
         #print(response)
     except ServerException as e:
         print(e)
@@ -37,88 +66,372 @@ def get_repo_list():
         list.append(name['repoName'])
     return list
 
-def get_tags(repo_name):
+def get_tags_page(repo_name, page):
+    # 每页单独构造 request，多个线程同时翻页时互不影响
     request = GetRepoTagsRequest.GetRepoTagsRequest()
     request.set_RepoName(repo_name)
     request.set_RepoNamespace(namespace)
     request.set_endpoint("cr.cn-shenzhen.aliyuncs.com")
+    request.set_Page(page)
 
     try:
-        response = apiClient.do_action_with_exception(request)
+        response = call_api(request)
         #print(response)
     except ServerException as e:
         print(e)
+        return None
     except ClientException as e:
         print(e)
+        return None
 
-    res = json.loads(response)
-    pages = res['data']['total']/res['data']['pageSize']
-    page = res['data']['page']
-    total = res['data']['total']
-    list = []
+    return json.loads(response)['data']
+
+def get_tag_records(repo_name, first=None):
+    """
+    第一页拿到 total 后，剩余页并发获取，结果按页码顺序合并
+        first - 已经取到的第一页，避免重复请求
+    返回 ([{tag, imageUpdate, ...}], total, missing)，missing 为获取失败的页码列表
+    """
+    data = first or get_tags_page(repo_name, 1)
+    if data is None:
+        return [], 0, [1]
 
-    for name in res['data']['tags']:
-        list.append(name['tag'])
+    total = data['total']
+    pages = int(math.ceil(total / float(data['pageSize']))) if data['pageSize'] else 1
+    page = data['page']
+    records = list(data['tags'])
+    missing = []
 
-    while page < pages:
-        page += 1
-        request.set_Page(page)
+    if page < pages:
+        with ThreadPoolExecutor(max_workers=min(page_workers, pages - page)) as executor:
+            # map 按提交顺序返回结果，保证标签顺序与串行翻页一致
+            numbers = range(page + 1, pages + 1)
+            for number, data in zip(numbers, executor.map(lambda p: get_tags_page(repo_name, p), numbers)):
+                if data is None:
+                    missing.append(number)
+                    continue
+                records.extend(data['tags'])
 
+    return records, total, missing
+
+class TagSnapshot(object):
+    """
+    本地 SQLite 标签快照，记录每个仓库的标签列表、total 与最新标签
+    每次操作使用独立的短连接，列标签/删除线程可共享同一个文件
+    """
+    def __init__(self, path):
+        self.path = path
+        db = self._connect()
         try:
-            response = apiClient.do_action_with_exception(request)
-        except ServerException as e:
-            print(e)
-        except ClientException as e:
-            print(e)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+            CREATE TABLE IF NOT EXISTS repos (
+                repo TEXT PRIMARY KEY,
+                total INTEGER NOT NULL,
+                newest TEXT,
+                updated_at TEXT NOT NULL
+            )
+            """)
+            db.execute("""
+            CREATE TABLE IF NOT EXISTS tags (
+                repo TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                image_update INTEGER,
+                seq INTEGER NOT NULL,
+                PRIMARY KEY (repo, tag)
+            )
+            """)
+            db.commit()
+        finally:
+            db.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def repos(self):
+        db = self._connect()
+        try:
+            return [row[0] for row in db.execute("SELECT repo FROM repos ORDER BY repo")]
+        finally:
+            db.close()
+
+    def get(self, repo):
+        """返回 (total, newest)，仓库不在快照中时返回 None"""
+        db = self._connect()
+        try:
+            return db.execute("SELECT total, newest FROM repos WHERE repo = ?", (repo,)).fetchone()
+        finally:
+            db.close()
+
+    def tags(self, repo):
+        """按接口返回顺序给出快照中的标签 [{tag, imageUpdate}]"""
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT tag, image_update FROM tags WHERE repo = ? ORDER BY seq", (repo,))
+            return [{'tag': tag, 'imageUpdate': image_update} for tag, image_update in rows]
+        finally:
+            db.close()
+
+    def save(self, repo, records, total):
+        newest = records[0]['tag'] if records else None
+        db = self._connect()
+        try:
+            with db:
+                db.execute("DELETE FROM tags WHERE repo = ?", (repo,))
+                db.executemany(
+                    "INSERT OR REPLACE INTO tags (repo, tag, image_update, seq) VALUES (?, ?, ?, ?)",
+                    [(repo, r['tag'], r.get('imageUpdate'), i) for i, r in enumerate(records)]
+                )
+                db.execute(
+                    "INSERT OR REPLACE INTO repos (repo, total, newest, updated_at) VALUES (?, ?, ?, datetime('now'))",
+                    (repo, total, newest)
+                )
+        finally:
+            db.close()
+
+    def remove(self, repo, tag):
+        # 删除成功后同步快照，下次运行时 total 能与接口对上
+        db = self._connect()
+        try:
+            with db:
+                cur = db.execute("DELETE FROM tags WHERE repo = ? AND tag = ?", (repo, tag))
+                if cur.rowcount:
+                    db.execute(
+                        "UPDATE repos SET total = total - 1, updated_at = datetime('now') WHERE repo = ?",
+                        (repo,)
+                    )
+        finally:
+            db.close()
+
+def list_repo(job):
+    """
+    列出仓库标签，返回 ([{tag, imageUpdate}], total, cached)
+    第一页的 total 与最新标签都和快照一致时直接使用快照，只花一次请求
+    """
+    first = get_tags_page(job, 1)
+    if first is None:
+        raise Exception("获取第一页标签失败")
 
-        res = json.loads(response)
-        for name in res['data']['tags']:
-            list.append(name['tag'])
+    if snapshot is not None and not full_listing:
+        cached = snapshot.get(job)
+        newest = first['tags'][0]['tag'] if first['tags'] else None
+        if cached is not None and cached == (first['total'], newest):
+            return snapshot.tags(job), first['total'], True
 
-    #list.sort(key=lambda x:int(x.split('-')[2]))
-    return list, total
+    records, total, missing = get_tag_records(job, first)
+    if missing:
+        # 列表不完整时不写快照（否则 total 对得上会一直复用残缺的快照），本轮也不删除
+        raise Exception("第 {} 页标签获取失败，跳过该仓库".format(missing))
+    if snapshot is not None:
+        snapshot.save(job, records, total)
+    return records, total, False
 
-def delete_images(job, tags, namespace):
-    global times
-    tags.sort(key=lambda x:int(x.split('-')[2]))
+class TokenBucket(object):
+    """
+    令牌桶限速，所有删除线程共用一个实例
+        rate  - 每秒补充的令牌数（即目标 QPS）
+        burst - 桶容量，允许的瞬时突发
+    遇到限流时速率减半，之后每次成功按上限的 5% 逐步恢复
+    """
+    def __init__(self, rate, burst, min_rate=0.1):
+        self.max_rate = float(rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.rate = self.max_rate
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_throttle(self):
+        with self.lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            # 清空桶，避免其他线程紧接着再打一波突发
+            self.tokens = 0
+            self.throttled += 1
+            print("触发限流，删除速率降为 {:.2f}/s".format(self.rate))
+
+    def on_success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+limiter = TokenBucket(5, 10)
+
+def is_throttled(e):
+    # 阿里云限流错误码形如 Throttling / Throttling.User / Throttling.Api
+    code = e.get_error_code() or ''
+    return code.startswith('Throttling') or e.get_http_status() == 429
+
+def delete_image(job, tag, namespace):
     request = DeleteImageRequest.DeleteImageRequest()
     request.set_RepoNamespace(namespace)
     request.set_RepoName(job)
+    request.set_Tag(tag)
 
-    for tag in tags[0:-30]:
-        request.set_Tag(tag)
+    for attempt in range(delete_retries + 1):
+        limiter.acquire()
         try:
-            response = apiClient.do_action_with_exception(request)
+            call_api(request)
+            limiter.on_success()
+            return True
         except ServerException as e:
+            if is_throttled(e) and attempt < delete_retries:
+                limiter.on_throttle()
+                continue
             print(e)
+            return False
         except ClientException as e:
             print(e)
-        times += 1
+            return False
+
+class RepoReport(object):
+    """单个仓库的清理进度，删除线程完成最后一个标签时打印汇总"""
+    def __init__(self, job, total):
+        self.job = job
+        self.total = total
+        self.cached = False
+        self.planned = self.deleted = self.failed = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+
+    def done(self, ok):
+        with self.lock:
+            if ok:
+                self.deleted += 1
+            else:
+                self.failed += 1
+            if self.deleted + self.failed < self.planned:
+                return
+        self.finish()
+
+    def finish(self):
+        print("{:35} 删除:{:<5} 失败:{:<5} 保留:{:<5} 耗时:{:.1f}s".format(
+            self.job, self.deleted, self.failed, self.total - self.deleted, time.monotonic() - self.started))
 
-        if times % 10 == 0:
-            time.sleep(60)
+def plan_repo(job, records, total):
+    tags = [r['tag'] for r in records]
+    # imageUpdate 是毫秒时间戳
+    timestamps = {r['tag']: r['imageUpdate'] / 1000.0 for r in records if r.get('imageUpdate')}
+    result = policy.evaluate(tags, timestamps)
+    counts = " ".join("{}:{:<5}".format(name, n) for name, n in result.counts.items())
+    print("{:35} {} total:{:<5}".format(job, counts, total))
+
+    report = RepoReport(job, total)
+    report.planned = len(result.delete)
+    return report, result.delete
+
+def delete_tag(report, tag):
+    try:
+        ok = delete_image(report.job, tag, namespace)
+        if ok and snapshot is not None:
+            snapshot.remove(report.job, tag)
+    except Exception as e:
+        print(e)
+        ok = False
+    report.done(ok)
+
+def cleanup(jobs):
+    """
+    流水线清理：列标签和删除各用一个线程池
+    某个仓库的标签列完就立即把待删标签投给删除池，同时继续列后面的仓库
+    """
+    reports = []
+    with ThreadPoolExecutor(max_workers=list_workers) as list_pool, \
+         ThreadPoolExecutor(max_workers=delete_workers) as delete_pool:
+        listing = {list_pool.submit(list_repo, job): job for job in jobs}
+        for future in as_completed(listing):
+            job = listing[future]
+            try:
+                records, total, cached = future.result()
+                report, doomed = plan_repo(job, records, total)
+            except Exception as e:
+                print("{:35} 列标签失败: {}".format(job, e))
+                continue
+            report.cached = cached
+            reports.append(report)
+            if not doomed:
+                report.finish()
+                continue
+            for tag in doomed:
+                delete_pool.submit(delete_tag, report, tag)
+    return reports
+
+def plan(snapshot):
+    """只读快照计算待删除标签，不访问 API"""
+    planned = 0
+    repos = snapshot.repos()
+    for job in repos:
+        try:
+            report, doomed = plan_repo(job, snapshot.tags(job), snapshot.get(job)[0])
+        except Exception as e:
+            print("{:35} 计算失败: {}".format(job, e))
+            continue
+        for tag in doomed:
+            print("    - {}".format(tag))
+        planned += len(doomed)
+    print("仓库:{} 计划删除:{}".format(len(repos), planned))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="清理阿里云 ACR 镜像")
+    parser.add_argument("--rate", type=float, default=5, help="删除请求速率上限 (次/秒)，默认 5")
+    parser.add_argument("--burst", type=int, default=10, help="令牌桶容量，允许的瞬时突发，默认 10")
+    parser.add_argument("--list-workers", type=int, default=4, help="同时列标签的仓库数，默认 4")
+    parser.add_argument("--delete-workers", type=int, default=4, help="并发删除线程数，默认 4")
+    parser.add_argument("--max-inflight", type=int, default=16, help="全局同时进行中的 API 请求上限，默认 16")
+    parser.add_argument("--retries", type=int, default=5, help="被限流时单个镜像的重试次数，默认 5")
+    parser.add_argument("--snapshot", default=DEFAULT_SNAPSHOT, help=f"本地标签快照路径，默认 {DEFAULT_SNAPSHOT}")
+    parser.add_argument("--no-snapshot", action="store_true", help="不读写快照，每次全量列出标签")
+    parser.add_argument("--full", action="store_true", help="忽略快照全量列出标签，并刷新快照")
+    parser.add_argument("--policy", help="保留策略文件 (JSON/YAML)，默认每类 merge/gray 按构建号保留最新 30 个")
+    parser.add_argument("--plan", action="store_true", help="只根据快照打印待删除标签，不调用 API")
+    return parser.parse_args()
 
 def main():
-    jobs = get_repo_list()
+    global limiter, api_slots, list_workers, delete_workers, delete_retries, snapshot, full_listing, policy
+    args = parse_args()
+    if args.policy:
+        policy = retention.Policy.load(args.policy)
+    snapshot = None if args.no_snapshot else TagSnapshot(args.snapshot)
+    full_listing = args.full
+    if args.plan:
+        if snapshot is None:
+            sys.exit("--plan 需要快照")
+        plan(snapshot)
+        return
 
-    for job in jobs:
-        tags, total = get_tags(job)
+    limiter = TokenBucket(args.rate, args.burst)
+    api_slots = threading.BoundedSemaphore(max(1, args.max_inflight))
+    list_workers = max(1, args.list_workers)
+    delete_workers = max(1, args.delete_workers)
+    delete_retries = max(0, args.retries)
 
-        list_gray = []
-        list_merge = []
-        list_other = []
+    start = time.monotonic()
+    jobs = get_repo_list()
+    reports = cleanup(jobs)
 
-        for tag in tags:
-            if 'merge' in tag:
-                list_merge.append(tag)
-            elif 'gray' in tag:
-                list_gray.append(tag)
-            else:
-                list_other.append(tag)
-        print("{:35} merge:{:<5} gray:{:<5} other:{:<5} total:{:<5}".format(job, len(list_merge), len(list_gray), len(list_other), total))
-        list_merge.sort(key=lambda x:int(x.split('-')[2]))
-        delete_images(job, list_merge, namespace)
-        delete_images(job, list_gray, namespace)
+    deleted = sum(r.deleted for r in reports)
+    failed = sum(r.failed for r in reports)
+    cached = sum(1 for r in reports if r.cached)
+    print("仓库:{} 命中快照:{} 删除:{} 失败:{} 耗时:{:.1f}s".format(len(reports), cached, deleted, failed, time.monotonic() - start))
+    if limiter.throttled:
+        print("共触发限流 {} 次，最终删除速率 {:.2f}/s".format(limiter.throttled, limiter.rate))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# 对比 handle_log.py 的几种解析方式 (rows/s)
+#   python3 bench_handle_log.py --lines 2000000
+# 原始的 for line in f 循环作为基线；压缩格式各自测试一次流式解压
+
+import os
+import gzip
+import lzma
+import time
+import random
+import argparse
+import tempfile
+import handle_log
+
+def make_file(path, lines, projects):
+    names = [f"/data/app/logs/project-{i}" for i in range(projects)]
+    with open(path, "w", encoding="utf-8") as f:
+        for _ in range(lines):
+            f.write(f"{random.randint(0, 10**10)},{random.choice(names)}\n")
+
+def baseline(f_name):
+    # 原始实现：for line in f + split
+    count = 0
+    with open(f_name, "r", encoding="utf-8") as f:
+        for line in f:
+            r = line.rstrip().split(",", 2)
+            res = {}
+            res["project"] = r[1]
+            res["value"] = int(r[0])/(1024**3)
+            count += 1
+    return count
+
+def consume(f_name, reader, lines):
+    # iter_rows 按项目累加后每个项目只产出一条，rows/s 仍按原始行数计算
+    for _ in handle_log.iter_rows(f_name, "2025-01-01", reader):
+        pass
+    return lines
+
+def records(f_name, reader):
+    # 只解析 (字节数, 项目名)，不构造行字典
+    count = 0
+    for _ in handle_log.iter_records(f_name, reader):
+        count += 1
+    return count
+
+def run(label, func, *args):
+    start = time.monotonic()
+    count = func(*args)
+    elapsed = time.monotonic() - start
+    rate = count / elapsed if elapsed > 0 else 0
+    print(f"{label:16} {count:>10} {elapsed:>10.2f} {rate:>12.0f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="handle_log.py 解析方式基准测试")
+    parser.add_argument("--lines", type=int, default=2000000)
+    parser.add_argument("--projects", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        plain = os.path.join(tmp, "0101.txt")
+        make_file(plain, args.lines, args.projects)
+
+        with open(plain, "rb") as src:
+            data = src.read()
+        with gzip.open(plain + ".gz", "wb", compresslevel=6) as f:
+            f.write(data)
+        with lzma.open(plain + ".xz", "wb") as f:
+            f.write(data)
+        if handle_log.zstandard:
+            with open(plain + ".zst", "wb") as f:
+                f.write(handle_log.zstandard.ZstdCompressor().compress(data))
+        del data
+
+        print(f"{'reader':16} {'rows':>10} {'seconds':>10} {'rows/s':>12}")
+        run("baseline", baseline, plain)
+        run("text", consume, plain, "text", args.lines)
+        run("mmap", consume, plain, "mmap", args.lines)
+        run("records/text", records, plain, "text")
+        run("records/mmap", records, plain, "mmap")
+        run("gzip", consume, plain + ".gz", "text", args.lines)
+        run("xz", consume, plain + ".xz", "text", args.lines)
+        if handle_log.zstandard:
+            run("zstd", consume, plain + ".zst", "text", args.lines)
+        else:
+            print("zstd             未安装 zstandard，跳过")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import json
 import requests
-import re
+import retention
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
 
 nexus_user = "admin"
 nexus_pass = "password"
@@ -8,37 +11,151 @@ nexus_pass = "password"
 nexus_url = "http://192.168.0.1:8081/repository/springcloud-hosted/v2"
 registry_url = "{}/_catalog".format(nexus_url)
 
-def delete_image(tag_list, name):
-    for tag in tag_list:
-        digest_url = "{}/{}/manifests/{}".format(nexus_url, name, tag)
-        r = requests.head(digest_url, auth=(nexus_user, nexus_pass), headers={"Accept":"application/vnd.docker.distribution.manifest.v2+json"})
+# 每页 catalog 的镜像数、并发拉取标签的线程数、每个镜像并发 HEAD 的线程数
+catalog_page_size = 500
+workers = 8
+resolve_workers = 4
 
-        if r.ok:
-            header = r.headers
-            digest = header["Docker-Content-Digest"]
-            del_url = "{}/{}/manifests/{}".format(nexus_url, name, digest)
-            r = requests.delete(del_url, auth=(nexus_user, nexus_pass))
+# 保留策略：debug 标签按接口返回顺序保留最后 7 个，其余标签不动
+# tags/list 不带推送时间，max_age 规则对 Nexus 不生效
+DEFAULT_POLICY = [
+    {"name": "debug", "pattern": "debug", "keep": 7, "sort": "order"},
+]
+policy = retention.Policy(DEFAULT_POLICY)
 
-r = requests.get(registry_url, auth=(nexus_user, nexus_pass))
+# HEAD 时接受所有 manifest 类型，拿到的 digest 与仓库中存储的一致
+MANIFEST_ACCEPT = ", ".join([
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+])
 
-if r.ok:
-    image_name_list = json.loads(r.text)
-else:
-    print(r.text)
+def make_session():
+    # 一个带连接池的 Session，所有线程复用 keep-alive 连接，认证信息只设置一次
+    session = requests.Session()
+    session.auth = (nexus_user, nexus_pass)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers * resolve_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
 
-for image_name in image_name_list["repositories"]:
-    image_tags_url = "{}/{}/tags/list".format(nexus_url, image_name)
-    r = requests.get(image_tags_url, auth=(nexus_user, nexus_pass))
+def iter_catalog(session):
+    """
+    按 n/last 分页逐页读取 _catalog，下一页的 last 优先取 Link 头里的值
+    每次只在内存里保留一页镜像名
+    服务端忽略 n/last（返回超过 n 条、last 未生效或不前进）时停止翻页，不会重复处理同一批镜像
+    """
+    params = {"n": catalog_page_size}
+    while params:
+        r = session.get(registry_url, params=params)
+        if not r.ok:
+            print(r.text)
+            return
+        repositories = r.json().get("repositories") or []
+        if "last" in params and params["last"] in repositories:
+            # 正常分页只返回 last 之后的镜像，包含 last 说明服务端忽略了该参数，这一页已处理过
+            print("catalog 分页 last 未生效，停止翻页: {}".format(params["last"]))
+            return
+        for image_name in repositories:
+            yield image_name
+
+        if len(repositories) > int(params["n"]):
+            # 返回条数超过 n 说明服务端不支持分页，这一页已是全量
+            print("catalog 不支持分页，已按全量处理")
+            return
+
+        if "next" in r.links:
+            # Link: </v2/_catalog?last=xxx&n=500>; rel="next"
+            # 路径是相对 registry 根的 /v2，Nexus 实际挂在 /repository/<repo>/v2 下，
+            # 直接跟随会丢掉仓库前缀，所以只取 last/n，仍然请求 registry_url
+            query = parse_qs(urlparse(r.links["next"]["url"]).query)
+            last = query.get("last", [repositories[-1] if repositories else None])[0]
+            next_params = {"n": query.get("n", [catalog_page_size])[0], "last": last} if last else None
+        elif len(repositories) >= catalog_page_size:
+            # 个别版本不返回 Link 头，用最后一个镜像名继续翻页
+            next_params = {"n": catalog_page_size, "last": repositories[-1]}
+        else:
+            next_params = None
 
+        if next_params and next_params["last"] == params.get("last"):
+            # last 没有前进，服务端忽略了 last 参数，继续请求只会重复同一页
+            print("catalog 分页 last 未前进，停止翻页: {}".format(next_params["last"]))
+            return
+        params = next_params
+
+def resolve_digest(session, name, tag):
+    digest_url = "{}/{}/manifests/{}".format(nexus_url, name, tag)
+    r = session.head(digest_url, headers={"Accept": MANIFEST_ACCEPT})
     if r.ok:
-        debug_list = []
+        return r.headers.get("Docker-Content-Digest")
+    return None
+
+def resolve_digests(session, name, tags):
+    """并发 HEAD 所有标签，返回 {tag: digest}，解析失败的标签值为 None"""
+    if not tags:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(resolve_workers, len(tags))) as executor:
+        digests = executor.map(lambda tag: resolve_digest(session, name, tag), tags)
+        return dict(zip(tags, digests))
+
+def delete_image(session, del_list, keep_list, name):
+    """
+    按 digest 删除：同一 digest 只删一次，被保留标签引用的 digest 不删
+    删除 manifest 会连带删掉指向它的所有标签
+    """
+    digests = resolve_digests(session, name, del_list + keep_list)
+
+    unresolved = [tag for tag in keep_list if digests[tag] is None]
+    if unresolved:
+        # 不知道保留标签指向哪个 digest 时不能确定删除是否安全，整个镜像跳过
+        print("{} 保留标签解析失败，跳过: {}".format(name, unresolved))
+        return
 
+    keep_digests = {digests[tag] for tag in keep_list}
+    del_digests = {digests[tag] for tag in del_list if digests[tag] is not None}
+    protected = del_digests & keep_digests
+
+    deleted = 0
+    for digest in sorted(del_digests - keep_digests):
+        del_url = "{}/{}/manifests/{}".format(nexus_url, name, digest)
+        r = session.delete(del_url)
+        if r.ok:
+            deleted += 1
+        else:
+            print(name, digest, r.status_code)
+
+    if del_list:
+        print("{} 待删标签:{} 删除digest:{} 受保护digest:{}".format(name, len(del_list), deleted, len(protected)))
+
+def clean_image(session, image_name):
+    image_tags_url = "{}/{}/tags/list".format(nexus_url, image_name)
+    r = session.get(image_tags_url)
+
+    if r.ok:
         tags = json.loads(r.text)
+        result = policy.evaluate(tags["tags"] or [])
 
-        for tag in tags["tags"]:
-            if re.search("debug", tag):
-                debug_list.append(tag)
+        if result.delete:
+            delete_image(session, result.delete, result.keep, image_name)
+    else:
+        print(image_name, r.text)
 
-        del_list_debug = debug_list[:-7]
+def main():
+    session = make_session()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for image_name in iter_catalog(session):
+            # 在途任务数有上限，catalog 再大也不会一次性堆积全部镜像
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception():
+                        print(future.exception())
+            pending.add(executor.submit(clean_image, session, image_name))
+        for future in wait(pending).done:
+            if future.exception():
+                print(future.exception())
 
-        delete_image(del_list_debug, image_name)
+if __name__ == "__main__":
+    main()
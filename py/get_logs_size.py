@@ -1,162 +1,663 @@
 #!/usr/bin/env python3
 
-import pymysql
+import re
+import sys
+import time
+import queue
+import shlex
+import threading
+import argparse
 import datetime
 import logging
+import log_data
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-from kubernetes import client, config
+from kubernetes import client, config, watch
 from kubernetes.stream import stream
 from kubernetes.client.rest import ApiException
 
 # 初始化全局变量
 namespace = "app"
 log_file_path = "/data/app/logs/run_json.log"
+# 默认统计的日志文件；--log-path 可指定多个路径或 glob（如轮转后的 run_json.log.*）
+DEFAULT_LOG_PATHS = [log_file_path]
 today_date = datetime.datetime.now().date()
 
+# 并发 exec 数与单次 exec 超时（秒）
+DEFAULT_CONCURRENCY = 20
+DEFAULT_EXEC_TIMEOUT = 30
+
+# node 采集模式：每个节点上运行一个挂载了 kubelet Pod 目录的特权 agent Pod（通常是 DaemonSet）
+DEFAULT_AGENT_NAMESPACE = "kube-system"
+DEFAULT_AGENT_SELECTOR = "app=log-size-agent"
+DEFAULT_KUBELET_ROOT = "/var/lib/kubelet/pods"
+
+# daemon 模式的采样间隔与单次 watch 的超时（秒）
+DEFAULT_INTERVAL = 300
+WATCH_TIMEOUT = 300
+
 # 初始化日志
 logging.basicConfig(
     level=logging.WARN,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-# 初始化
-try:
-    config.load_kube_config(config_file="/data/scripts/config/k8s01.config")
-except Exception as e:
-    logging.info(f"初始化Kubernetes客户端失败: {str(e)}")
-    raise
-
-apps_v1 = client.AppsV1Api()
-core_v1 = client.CoreV1Api()
-
-def insert_to_mysql(data):
-    config = {
-        'host': '192.168.1.1',
-        'port': 3306,
-        'user': 'grafana',
-        'password': '123456',
-        'database': 'test',
-        'charset': 'utf8mb4',
-        'autocommit': True,
-    }
+# 默认集群：环境名=kubeconfig[@context]，环境名写入 log_data.environment
+DEFAULT_CLUSTERS = ["k8s01=/data/scripts/config/k8s01.config"]
+# 单个集群一次采集的最长等待时间（秒），超时的集群本轮不写入
+DEFAULT_CLUSTER_TIMEOUT = 600
+
+class Cluster:
+    """
+    单个集群及其独立的 API 客户端
+    """
+    def __init__(self, environment, kubeconfig, context=None):
+        self.environment = environment
+        try:
+            api_client = config.new_client_from_config(config_file=kubeconfig, context=context)
+        except Exception as e:
+            logging.error(f"初始化Kubernetes客户端失败 [{environment}]: {str(e)}")
+            raise
+        self.apps_v1 = client.AppsV1Api(api_client)
+        self.core_v1 = client.CoreV1Api(api_client)
 
+    @classmethod
+    def parse(cls, spec):
+        """
+        解析 环境名=kubeconfig[@context]
+        """
+        environment, sep, rest = spec.partition("=")
+        if not sep or not environment or not rest:
+            raise ValueError(f"无效的集群配置: {spec}，格式为 环境名=kubeconfig[@context]")
+        kubeconfig, _, context = rest.partition("@")
+        return cls(environment, kubeconfig, context or None)
+
+def insert_to_mysql(results, engine="executemany", rollups=True, date=None, require_upsert_key=False):
+    """
+    将所有集群的结果一次性写入 log_data
+        results - { environment: { deployment_name: total_size_bytes } }
+        require_upsert_key - log_data 缺少 upsert 唯一索引时放弃写入；默认只记录错误日志
+    """
     sql_data = []
-    for i in data:
-        r = {}
-        r["environment"] = "k8s01"
-        r["project"]=i
-        r["value"]=data[i] / (1024 * 1024 * 1024)
-        r["date"]=today_date
-        sql_data.append(r)
+    for environment, data in results.items():
+        for i in data:
+            r = {}
+            r["environment"] = environment
+            r["project"]=i
+            r["value"]=data[i] / (1024 * 1024 * 1024)
+            r["date"]=date or today_date
+            sql_data.append(r)
 
     logging.info(sql_data)
 
+    writer = log_data.LogDataWriter(engine=engine, rollups=rollups)
     try:
-        conn = pymysql.connect(**config)
-        with conn.cursor() as cursor:
-            sql = """
-            INSERT INTO log_data (environment, date, value, project_name) VALUES (%(environment)s, %(date)s, %(value)s, %(project)s)
-            """
-            # 使用 executemany 批量插入
-            logging.info(sql)
-            cursor.executemany(sql, sql_data)
-            print(f"批量插入 {cursor.rowcount} 条记录")
-        conn.commit()
-    except pymysql.MySQLError as e:
-        logging.error(f"MySQL 错误: {e}")
-        conn.rollback()  # 回滚事务
+        writer.ensure_tables(require_upsert_key)
+        rows = writer.write(sql_data)
+        print(f"批量写入 {rows} 条记录")
     except Exception as e:
-        logging.error(f"其他错误: {e}")
-        conn.rollback()
+        logging.error(f"写入 log_data 失败: {e}")
     finally:
-        # 🧹 关闭连接
-        if conn:
-            conn.close()
+        writer.log_stats()
+        writer.close()
 
-def get_pods_by_deployment(deployment_name, namespace):
+def list_running_pods(core_v1, namespace):
     """
-    根据 Deployment 的 selector 获取其管理的所有 Pod
+    一次性列出命名空间中所有 Running 的 Pod
     """
-    try:
-        deployment = apps_v1.read_namespaced_deployment(deployment_name, namespace)
-        selector = deployment.spec.selector.match_labels
-        label_selector = ','.join([f"{k}={v}" for k, v in selector.items()])
-        pods = core_v1.list_namespaced_pod(namespace, label_selector=label_selector)
-        return pods.items
-    except Exception as e:
-        logging.error(f"无法获取 Deployment {deployment_name} 的 Pod: {e}")
+    pods = core_v1.list_namespaced_pod(namespace, field_selector="status.phase=Running")
+    return pods.items
+
+def build_pod_index(pods):
+    """
+    建立 (label_key, label_value) -> Pod 下标集合 的索引
+    """
+    index = {}
+    for i, pod in enumerate(pods):
+        for item in (pod.metadata.labels or {}).items():
+            index.setdefault(item, set()).add(i)
+    return index
+
+def _match_expression(labels, expr):
+    value = labels.get(expr.key)
+    if expr.operator == "In":
+        return value is not None and value in expr.values
+    if expr.operator == "NotIn":
+        return value is None or value not in expr.values
+    if expr.operator == "Exists":
+        return expr.key in labels
+    if expr.operator == "DoesNotExist":
+        return expr.key not in labels
+    return False
+
+def get_pods_by_deployment(deployment, pods, index):
+    """
+    根据 Deployment 的 selector 在本地索引中匹配其管理的所有 Pod
+    """
+    selector = deployment.spec.selector
+    match_labels = selector.match_labels or {}
+    match_expressions = selector.match_expressions or []
+    if not match_labels and not match_expressions:
         return []
 
-def get_file_size_in_container(pod_name, container_name, namespace):
+    if match_labels:
+        # 从最小的集合开始求交集
+        sets = sorted((index.get(item, set()) for item in match_labels.items()), key=len)
+        matched = set.intersection(*sets)
+    else:
+        matched = set(range(len(pods)))
+
+    result = []
+    for i in sorted(matched):
+        labels = pods[i].metadata.labels or {}
+        if all(_match_expression(labels, expr) for expr in match_expressions):
+            result.append(pods[i])
+    return result
+
+def quote_glob(pattern):
+    """
+    对路径做 shell 转义，保留 * ? [ ] 使其仍可由 shell 展开
+    """
+    return "".join(
+        part if re.fullmatch(r"[*?\[\]]+", part) else shlex.quote(part)
+        for part in re.split(r"([*?\[\]]+)", pattern) if part
+    )
+
+def listing_script(patterns):
+    """
+    生成一次列出所有匹配文件的 shell 脚本，每行输出 路径|大小|mtime
+    """
+    files = " ".join(quote_glob(p) for p in patterns)
+    return f'for f in {files}; do [ -f "$f" ] && stat -c "%n|%s|%Y" "$f"; done; true'
+
+def parse_listing(output):
+    """
+    解析 listing_script 的输出，返回 { path: (size, mtime) }
+    同一文件被多个模式匹配时只计一次
+    """
+    files = {}
+    for line in output.splitlines():
+        parts = line.rsplit("|", 2)
+        if len(parts) == 3 and parts[1].isdigit() and parts[2].isdigit():
+            files[parts[0]] = (int(parts[1]), int(parts[2]))
+    return files
+
+def list_files_in_container(core_v1, pod_name, container_name, namespace, patterns, timeout=DEFAULT_EXEC_TIMEOUT):
     """
-    执行 exec 命令获取容器中指定文件的大小（字节）
-    如果文件不存在或命令失败，返回 0
+    在容器中执行一次 exec，列出所有匹配 patterns 的文件
+    返回 { path: (size, mtime) }，命令失败或超时返回空字典
     """
     try:
-        # 使用 exec 执行 stat 命令获取文件大小
         resp = stream(
             core_v1.connect_get_namespaced_pod_exec,
             name=pod_name,
             namespace=namespace,
-            command=['sh', '-c', f'stat -c %s "{log_file_path}" 2>/dev/null || echo 0'],
+            container=container_name,
+            command=['sh', '-c', listing_script(patterns)],
             stdout=True,
-            stderr=True,
+            stderr=False,
             stdin=False,
-            tty=False
+            tty=False,
+            _request_timeout=timeout
         )
-        return int(resp) if resp.isdigit() else 0
+        return parse_listing(resp)
     except ApiException as e:
         logging.error(f"Exec 失败 [{namespace}/{pod_name} - {container_name}]: {e}")
-        return 0
+        return {}
     except Exception as e:
         logging.error(f"未知错误 [{namespace}/{pod_name} - {container_name}]: {e}")
-        return 0
+        return {}
 
-def main():
+def collect_sizes(core_v1, targets, namespace, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_EXEC_TIMEOUT):
+    """
+    通过有上限的线程池并发执行 exec，每个容器一次
+        targets - [(key, pod_name, container_name, patterns)]，key 通常为 Deployment 名或 Pod UID
+    返回 { key: total_size_bytes }
+    """
+    result = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(list_files_in_container, core_v1, pod_name, container_name, namespace, patterns, timeout): (dep_name, pod_name, container_name)
+            for dep_name, pod_name, container_name, patterns in targets
+        }
+        for future in as_completed(futures):
+            dep_name, pod_name, container_name = futures[future]
+            files = future.result()
+            size = sum(size for size, _ in files.values())
+            result[dep_name] = result.get(dep_name, 0) + size
+            if size > 0:
+                logging.info(f"Pod: {pod_name}, 容器: {container_name}, {len(files)} 个日志文件, 大小: {size / (1024*1024):.2f} MB")
+    return result
+
+def node_log_patterns(pod, patterns, kubelet_root=DEFAULT_KUBELET_ROOT):
+    """
+    将各容器内的日志路径模式映射为节点上的路径模式
+    仅支持日志目录挂载为 emptyDir 的容器
+    返回 ({节点路径模式}, [(无法映射的容器名, [模式])])
+    """
+    volumes = {v.name: v for v in pod.spec.volumes or []}
+    node_patterns = set()
+    unmapped = []
+    for container in pod.spec.containers:
+        missing = []
+        for pattern in patterns:
+            # 取挂载点最长的匹配
+            best = None
+            for vm in container.volume_mounts or []:
+                mount_path = vm.mount_path.rstrip("/")
+                if pattern.startswith(mount_path + "/"):
+                    if best is None or len(mount_path) > len(best[0]):
+                        best = (mount_path, vm)
+            volume = volumes.get(best[1].name) if best else None
+            if volume is None or volume.empty_dir is None:
+                missing.append(pattern)
+                continue
+            mount_path, vm = best
+            rel = pattern[len(mount_path):].lstrip("/")
+            if vm.sub_path:
+                rel = f"{vm.sub_path}/{rel}"
+            node_patterns.add(f"{kubelet_root}/{pod.metadata.uid}/volumes/kubernetes.io~empty-dir/{vm.name}/{rel}")
+        if missing:
+            unmapped.append((container.name, missing))
+    return node_patterns, unmapped
+
+def list_node_agents(core_v1, agent_namespace, agent_selector):
+    """
+    返回 { node_name: agent_pod_name }
+    """
+    pods = core_v1.list_namespaced_pod(agent_namespace, label_selector=agent_selector, field_selector="status.phase=Running")
+    return {pod.spec.node_name: pod.metadata.name for pod in pods.items}
+
+def list_files_on_node(core_v1, agent_pod, agent_namespace, patterns, timeout=DEFAULT_EXEC_TIMEOUT):
+    """
+    在节点 agent 中执行一次 exec，列出该节点上所有匹配的文件
+    返回 { path: (size, mtime) }
+    """
+    resp = stream(
+        core_v1.connect_get_namespaced_pod_exec,
+        name=agent_pod,
+        namespace=agent_namespace,
+        command=['sh', '-c', listing_script(sorted(patterns))],
+        stdout=True,
+        stderr=False,
+        stdin=False,
+        tty=False,
+        _request_timeout=timeout
+    )
+    return parse_listing(resp)
+
+def collect_sizes_by_node(core_v1, dep_pods, patterns, agent_namespace, agent_selector, kubelet_root, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_EXEC_TIMEOUT):
+    """
+    每个节点执行一次 exec 统计该节点上所有 Pod、所有容器的日志大小，通过 Pod UID 映射回 key
+        dep_pods - { key: [pod] }，key 通常为 Deployment 名或 Pod UID
+    返回 ({ key: total_size_bytes }, 需要回退到容器 exec 的 targets)
+    """
+    agents = list_node_agents(core_v1, agent_namespace, agent_selector)
+    # node_name -> {节点路径模式}
+    by_node = {}
+    # pod_uid -> deployment_name
+    uid_to_dep = {}
+    fallback = []
+    for dep_name, pods in dep_pods.items():
+        for pod in pods:
+            if pod.spec.node_name not in agents:
+                node_patterns = set()
+                unmapped = [(c.name, patterns) for c in pod.spec.containers]
+            else:
+                node_patterns, unmapped = node_log_patterns(pod, patterns, kubelet_root)
+            if node_patterns:
+                by_node.setdefault(pod.spec.node_name, set()).update(node_patterns)
+                uid_to_dep[pod.metadata.uid] = dep_name
+            for container_name, missing in unmapped:
+                fallback.append((dep_name, pod.metadata.name, container_name, missing))
+
+    prefix = kubelet_root.rstrip("/") + "/"
+    result = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(list_files_on_node, core_v1, agents[node], agent_namespace, node_patterns, timeout): node
+            for node, node_patterns in by_node.items()
+        }
+        for future in as_completed(futures):
+            node = futures[future]
+            try:
+                files = future.result()
+            except Exception as e:
+                logging.error(f"节点 {node} exec 失败: {e}")
+                continue
+            for path, (size, _) in files.items():
+                uid = path[len(prefix):].split("/", 1)[0] if path.startswith(prefix) else None
+                dep_name = uid_to_dep.get(uid)
+                if dep_name:
+                    result[dep_name] = result.get(dep_name, 0) + size
+            logging.info(f"节点 {node}: {len(files)} 个日志文件")
+
+    if fallback:
+        logging.warning(f"{len(fallback)} 个容器无法在节点上定位日志，回退到容器内 exec")
+    return result, fallback
+
+def sample_sizes(core_v1, dep_pods, args):
+    """
+    按所选采集方式统计日志大小
+        dep_pods - { key: [pod] }
+    返回 { key: total_size_bytes }
+    """
+    if args.collector == "node":
+        sizes, targets = collect_sizes_by_node(core_v1, dep_pods, args.log_paths, args.agent_namespace, args.agent_selector, args.kubelet_root, args.concurrency, args.exec_timeout)
+    else:
+        sizes = {}
+        targets = [
+            (key, pod.metadata.name, container.name, args.log_paths)
+            for key, pod_list in dep_pods.items()
+            for pod in pod_list
+            for container in pod.spec.containers
+        ]
+
+    for key, size in collect_sizes(core_v1, targets, namespace, args.concurrency, args.exec_timeout).items():
+        sizes[key] = sizes.get(key, 0) + size
+    return sizes
+
+class PodInventory:
+    """
+    通过 watch 增量维护命名空间内 Deployment 与 Running Pod 的本地缓存
+    启动时各 LIST 一次，之后按 resourceVersion 续接 watch；resourceVersion 过期 (410) 时重新 LIST
+    新进入 Running 的 Pod 会放入 new_pods 队列；pod_sizes 保存最近一次采样结果
+    """
+    def __init__(self, cluster, namespace):
+        self.cluster = cluster
+        self.namespace = namespace
+        self.deployments = {}
+        self.pods = {}
+        self.pod_sizes = {}
+        self.sampled_at = None
+        self.new_pods = queue.Queue()
+        self._lock = threading.Lock()
+
+    def start(self):
+        pod_rv = self._list_pods()
+        dep_rv = self._list_deployments()
+        threading.Thread(target=self._watch, args=("pod", pod_rv), daemon=True).start()
+        threading.Thread(target=self._watch, args=("deployment", dep_rv), daemon=True).start()
+
+    def _list_pods(self):
+        pods = self.cluster.core_v1.list_namespaced_pod(self.namespace, field_selector="status.phase=Running")
+        with self._lock:
+            self.pods = {pod.metadata.uid: pod for pod in pods.items}
+        return pods.metadata.resource_version
+
+    def _list_deployments(self):
+        deployments = self.cluster.apps_v1.list_namespaced_deployment(self.namespace)
+        with self._lock:
+            self.deployments = {dep.metadata.name: dep for dep in deployments.items}
+        return deployments.metadata.resource_version
+
+    def _apply(self, kind, event_type, obj):
+        with self._lock:
+            if kind == "pod":
+                uid = obj.metadata.uid
+                if event_type == "DELETED":
+                    self.pods.pop(uid, None)
+                else:
+                    is_new = uid not in self.pods
+                    self.pods[uid] = obj
+                    if is_new:
+                        self.new_pods.put(uid)
+            else:
+                if event_type == "DELETED":
+                    self.deployments.pop(obj.metadata.name, None)
+                else:
+                    self.deployments[obj.metadata.name] = obj
+
+    def _watch(self, kind, resource_version):
+        if kind == "pod":
+            func, kwargs, relist = self.cluster.core_v1.list_namespaced_pod, {"field_selector": "status.phase=Running"}, self._list_pods
+        else:
+            func, kwargs, relist = self.cluster.apps_v1.list_namespaced_deployment, {}, self._list_deployments
+
+        while True:
+            try:
+                if resource_version is None:
+                    resource_version = relist()
+                w = watch.Watch()
+                for event in w.stream(func, self.namespace, resource_version=resource_version, timeout_seconds=WATCH_TIMEOUT, **kwargs):
+                    if event["type"] == "ERROR":
+                        raise ApiException(status=event["raw_object"].get("code"), reason=event["raw_object"].get("message"))
+                    obj = event["object"]
+                    resource_version = obj.metadata.resource_version
+                    self._apply(kind, event["type"], obj)
+            except ApiException as e:
+                if e.status == 410:
+                    logging.warning(f"[{self.cluster.environment}] {kind} watch resourceVersion 已过期，重新 LIST")
+                    resource_version = None
+                else:
+                    logging.error(f"[{self.cluster.environment}] {kind} watch 失败: {e}")
+                    time.sleep(5)
+            except Exception as e:
+                logging.error(f"[{self.cluster.environment}] {kind} watch 异常: {e}")
+                time.sleep(5)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.deployments.values()), list(self.pods.values())
+
+    def update_sizes(self, sizes, replace=False):
+        with self._lock:
+            if replace:
+                self.pod_sizes = dict(sizes)
+                self.sampled_at = time.monotonic()
+            else:
+                self.pod_sizes.update(sizes)
+
+    def totals(self):
+        """
+        返回 ({ deployment_name: total_size_bytes }, 最近一次全量采样时间)
+        """
+        with self._lock:
+            deployments = list(self.deployments.values())
+            pods = list(self.pods.values())
+            pod_sizes = dict(self.pod_sizes)
+            sampled_at = self.sampled_at
+        return aggregate_by_deployment(deployments, pods, pod_sizes), sampled_at
+
+def aggregate_by_deployment(deployments, pods, pod_sizes):
+    """
+    将 { pod_uid: size } 按 Deployment 汇总
+    """
+    index = build_pod_index(pods)
+    return {
+        dep.metadata.name: sum(pod_sizes.get(pod.metadata.uid, 0) for pod in get_pods_by_deployment(dep, pods, index))
+        for dep in deployments
+    }
+
+def sample_loop(inventory, args):
+    """
+    单个集群的采样线程：按 interval 采样所有 Running Pod，期间新出现的 Pod 立即采样
+    """
+    cluster = inventory.cluster
+    while True:
+        start = time.monotonic()
+        _, pods = inventory.snapshot()
+        try:
+            sizes = sample_sizes(cluster.core_v1, {pod.metadata.uid: [pod] for pod in pods}, args)
+            inventory.update_sizes(sizes, replace=True)
+            logging.warning(f"[{cluster.environment}] 采样 {len(pods)} 个 Pod, 耗时 {time.monotonic() - start:.1f}s")
+        except Exception as e:
+            logging.error(f"[{cluster.environment}] 采样失败: {e}")
+
+        # 等待下一轮采样，期间新出现的 Pod 立即采样
+        deadline = start + args.interval
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                uids = [inventory.new_pods.get(timeout=remaining)]
+            except queue.Empty:
+                break
+            while not inventory.new_pods.empty():
+                uids.append(inventory.new_pods.get_nowait())
+            _, pods = inventory.snapshot()
+            new = {pod.metadata.uid: [pod] for pod in pods if pod.metadata.uid in uids}
+            if new:
+                inventory.update_sizes(sample_sizes(cluster.core_v1, new, args))
+                logging.info(f"[{cluster.environment}] 新 Pod 已采样: {len(new)} 个")
+
+def run_daemon(clusters, args):
+    """
+    常驻模式：每个集群由 watch 维护 Pod 缓存，并在独立线程中按 interval 采样；
+    主线程按 interval 将各集群最近一次的采样结果一次性写入 log_data，
+    采样超过 cluster_timeout 未更新的集群本轮跳过，不影响其他集群
+    每轮按 (environment, date, project_name) upsert，同一天只保留最新一次采样，
+    因此要求 log_data 上有对应的唯一索引，否则每轮都会追加一行
+    """
+    writer = log_data.LogDataWriter(engine=args.engine, rollups=args.rollups)
     try:
-        deployments = apps_v1.list_namespaced_deployment(namespace)
-    except ApiException as e:
-        logging.WARN(f"无法列出 Deployment: {e}")
-        return
+        writer.ensure_tables()
+    except RuntimeError as e:
+        logging.error(e)
+        sys.exit(1)
+    finally:
+        writer.close()
+
+    inventories = []
+    for cluster in clusters:
+        inventory = PodInventory(cluster, namespace)
+        try:
+            inventory.start()
+        except Exception as e:
+            logging.error(f"[{cluster.environment}] 初始化 Pod 缓存失败: {e}")
+            continue
+        threading.Thread(target=sample_loop, args=(inventory, args), daemon=True).start()
+        inventories.append(inventory)
+
+    next_write = time.monotonic() + args.interval
+    while True:
+        time.sleep(max(0, next_write - time.monotonic()))
+        next_write += args.interval
+        results = {}
+        for inventory in inventories:
+            totals, sampled_at = inventory.totals()
+            if sampled_at is None or time.monotonic() - sampled_at > args.interval + args.cluster_timeout:
+                logging.warning(f"[{inventory.cluster.environment}] 没有最新的采样结果，本轮跳过")
+                continue
+            results[inventory.cluster.environment] = totals
+        if results:
+            insert_to_mysql(results, args.engine, args.rollups, datetime.date.today(), require_upsert_key=True)
 
+def collect_cluster(cluster, args):
+    """
+    单次采集一个集群，返回 { deployment_name: total_size_bytes }
+    """
+    deployments = cluster.apps_v1.list_namespaced_deployment(namespace)
     if not deployments.items:
-        logging.WARN(f"命名空间 '{namespace}' 中没有找到任何 Deployment。")
-        return
+        logging.warning(f"[{cluster.environment}] 命名空间 '{namespace}' 中没有找到任何 Deployment。")
+        return {}
+
+    pods = list_running_pods(cluster.core_v1, namespace)
+    index = build_pod_index(pods)
 
     # 存储结果：{ deployment_name: total_size_bytes }
     result = {}
+    dep_pods = {}
 
     for dep in deployments.items:
         dep_name = dep.metadata.name
-        logging.warn(f"处理 Deployment: {dep_name}")
+        logging.info(f"[{cluster.environment}] 处理 Deployment: {dep_name}")
+        result[dep_name] = 0
+        dep_pods[dep_name] = get_pods_by_deployment(dep, pods, index)
 
-        pods = get_pods_by_deployment(dep_name, namespace)
-        total_size = 0
+    result.update(sample_sizes(cluster.core_v1, dep_pods, args))
+    return result
 
-        for pod in pods:
-            if pod.status.phase != "Running":
-                continue
-            for container in pod.spec.containers:
-                container_name = container.name
-                pod_name = pod.metadata.name
-                logging.info(f"name: {container_name}, pod_name: {pod_name}")
-                size = get_file_size_in_container(pod_name, container_name, namespace)
-                total_size += size
-                if size > 0:
-                    logging.info(f"Pod: {pod.metadata.name}, 容器: {container_name}, 日志大小: {size / (1024*1024):.2f} MB")
+def collect_clusters(clusters, args):
+    """
+    每个集群一个线程并发采集，最多等待 cluster_timeout 秒
+    超时或失败的集群不出现在结果中，不影响其他集群
+    返回 { environment: { deployment_name: total_size_bytes } }
+    """
+    results = {}
+
+    def worker(cluster):
+        start = time.monotonic()
+        try:
+            results[cluster.environment] = collect_cluster(cluster, args)
+            logging.warning(f"[{cluster.environment}] 采集完成, 耗时 {time.monotonic() - start:.1f}s")
+        except Exception as e:
+            logging.error(f"[{cluster.environment}] 采集失败: {e}")
+
+    # 使用 daemon 线程，超时的集群不会阻塞进程退出
+    threads = [threading.Thread(target=worker, args=(cluster,), daemon=True) for cluster in clusters]
+    for t in threads:
+        t.start()
+    deadline = time.monotonic() + args.cluster_timeout
+    finished = {}
+    for cluster, t in zip(clusters, threads):
+        t.join(max(0, deadline - time.monotonic()))
+        if t.is_alive():
+            logging.error(f"[{cluster.environment}] 采集超时，本次不写入")
+        elif cluster.environment in results:
+            finished[cluster.environment] = results[cluster.environment]
+    return finished
 
-        result[dep_name] = total_size
+def parse_args():
+    parser = argparse.ArgumentParser(description="统计各 Deployment 的日志文件大小并写入 log_data")
+    parser.add_argument("--engine", choices=log_data.ENGINES, default="executemany", help="写入方式")
+    parser.add_argument("--no-rollups", dest="rollups", action="store_false", help="写入时不刷新汇总表")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="同时进行的 exec 数")
+    parser.add_argument("--exec-timeout", type=int, default=DEFAULT_EXEC_TIMEOUT, help="单次 exec 超时（秒）")
+    parser.add_argument("--log-path", dest="log_paths", action="append", help=f"要统计的日志文件，可重复指定，支持 glob，默认 {DEFAULT_LOG_PATHS}")
+    parser.add_argument("--collector", choices=["container", "node"], default="container", help="container: 每个容器一次 exec；node: 每个节点一次 exec")
+    parser.add_argument("--agent-namespace", default=DEFAULT_AGENT_NAMESPACE, help="node 模式下 agent Pod 所在命名空间")
+    parser.add_argument("--agent-selector", default=DEFAULT_AGENT_SELECTOR, help="node 模式下 agent Pod 的 label selector")
+    parser.add_argument("--kubelet-root", default=DEFAULT_KUBELET_ROOT, help="agent Pod 内 kubelet Pod 目录的挂载路径")
+    parser.add_argument("--daemon", action="store_true", help="常驻运行，通过 watch 增量维护 Pod 缓存并定期采样")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL, help="daemon 模式的采样间隔（秒）")
+    parser.add_argument("--cluster", dest="clusters", action="append", help=f"环境名=kubeconfig[@context]，可重复指定，默认 {DEFAULT_CLUSTERS}")
+    parser.add_argument("--cluster-timeout", type=int, default=DEFAULT_CLUSTER_TIMEOUT, help="单个集群一次采集的最长等待时间（秒）")
+    args = parser.parse_args()
+    args.log_paths = args.log_paths or DEFAULT_LOG_PATHS
+    args.clusters = args.clusters or DEFAULT_CLUSTERS
+    return args
+
+def load_clusters(specs):
+    """
+    逐个加载集群配置，某个 kubeconfig 缺失或损坏时记录错误并跳过，不影响其他集群
+    """
+    clusters = []
+    for spec in specs:
+        try:
+            clusters.append(Cluster.parse(spec))
+        except Exception as e:
+            logging.error(f"跳过集群 {spec}: {e}")
+    return clusters
+
+def main():
+    args = parse_args()
+    clusters = load_clusters(args.clusters)
+    if not clusters:
+        logging.error("没有可用的集群配置")
+        sys.exit(1)
+
+    if args.daemon:
+        run_daemon(clusters, args)
+        return
+
+    results = collect_clusters(clusters, args)
+    if not results:
+        logging.warning("没有任何集群采集成功")
+        return
 
     # 输出汇总结果
     print("\n" + "="*60)
-    print("Deployment 日志文件大小汇总 (/data/app/logs/run.log)")
+    print(f"Deployment 日志文件大小汇总 ({', '.join(args.log_paths)})")
     print("="*60)
-    for dep, size in result.items():
-        size_gb = size / (1024 * 1024 * 1024)
-        if size_gb > 10:
-            print(f"{dep:30} : {size_gb:8.2f} GB")
+    for environment, result in results.items():
+        for dep, size in result.items():
+            size_gb = size / (1024 * 1024 * 1024)
+            if size_gb > 10:
+                print(f"{environment:10} {dep:30} : {size_gb:8.2f} GB")
 
-    insert_to_mysql(result)
+    insert_to_mysql(results, args.engine, args.rollups)
 
 if __name__ == "__main__":
     main()
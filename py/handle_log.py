@@ -1,10 +1,26 @@
 #!/usr/bin/env python3
 
 import os
+import sys
 import re
+import io
+import gzip
+import lzma
+import mmap
+import time
+import sqlite3
+import hashlib
 import logging
-import pymysql
+import argparse
+import log_data
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime
+from itertools import islice
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # 初始化日志
 logging.basicConfig(
@@ -12,33 +28,265 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 
-def handle_data(name, s_date):
-    f_name = f"files/{name}"
-    logging.info(f_name)
-    l_res = []
-    with open(f_name, "r", encoding="utf-8") as f:
+# 每批插入/提交的行数
+DEFAULT_BATCH_SIZE = 5000
+
+# 默认的导入清单文件
+DEFAULT_MANIFEST = "ingest_manifest.db"
+
+class Manifest:
+    """
+    本地 SQLite 导入清单，记录每个文件的大小、mtime、内容哈希与已提交行数
+    每次操作使用独立的短连接，可在多线程/多进程中共享同一个文件
+    """
+    def __init__(self, path=DEFAULT_MANIFEST):
+        self.path = path
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                filename TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                rows_done INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+            """)
+            db.commit()
+        finally:
+            db.close()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def done_files(self):
+        """
+        返回已完成导入的文件 {filename: (size, mtime_ns)}
+        """
+        db = self._connect()
+        try:
+            rows = db.execute("SELECT filename, size, mtime_ns FROM files WHERE status = 'done'")
+            return {name: (size, mtime_ns) for name, size, mtime_ns in rows}
+        finally:
+            db.close()
+
+    def get(self, filename):
+        db = self._connect()
+        try:
+            return db.execute(
+                "SELECT size, mtime_ns, sha256, rows_done, status FROM files WHERE filename = ?",
+                (filename,)
+            ).fetchone()
+        finally:
+            db.close()
+
+    def _write(self, sql, args):
+        db = self._connect()
+        try:
+            with db:
+                db.execute(sql, args)
+        finally:
+            db.close()
+
+    def begin(self, filename, size, mtime_ns, sha256, rows_done):
+        self._write("""
+        INSERT OR REPLACE INTO files (filename, size, mtime_ns, sha256, rows_done, status, updated_at)
+        VALUES (?, ?, ?, ?, ?, 'loading', datetime('now'))
+        """, (filename, size, mtime_ns, sha256, rows_done))
+
+    def progress(self, filename, rows_done):
+        self._write(
+            "UPDATE files SET rows_done = ?, updated_at = datetime('now') WHERE filename = ?",
+            (rows_done, filename)
+        )
+
+    def finish(self, filename, size, mtime_ns, sha256, rows_done):
+        self._write("""
+        INSERT OR REPLACE INTO files (filename, size, mtime_ns, sha256, rows_done, status, updated_at)
+        VALUES (?, ?, ?, ?, ?, 'done', datetime('now'))
+        """, (filename, size, mtime_ns, sha256, rows_done))
+
+def file_sha256(f_name, chunk_size=1024*1024):
+    h = hashlib.sha256()
+    with open(f_name, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+# 当前进程使用的 log_data 写入器，由 init_writer 初始化
+_writer = None
+
+def init_writer(pool_size=1, engine="executemany", rollups=True):
+    global _writer
+    _writer = log_data.LogDataWriter(pool_size=pool_size, engine=engine, rollups=rollups)
+
+READERS = ("text", "mmap")
+
+def open_text(f_name):
+    """
+    按扩展名打开文件，.gz/.xz/.zst 以流式方式解压
+    """
+    if f_name.endswith(".gz"):
+        return gzip.open(f_name, "rt", encoding="utf-8")
+    if f_name.endswith(".xz"):
+        return lzma.open(f_name, "rt", encoding="utf-8")
+    if f_name.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{f_name}: 读取 .zst 文件需要安装 zstandard")
+        reader = zstandard.ZstdDecompressor().stream_reader(open(f_name, "rb"), closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return open(f_name, "r", encoding="utf-8")
+
+def is_compressed(f_name):
+    return f_name.endswith((".gz", ".xz", ".zst"))
+
+def iter_records_text(f_name):
+    """
+    逐行读取文本（或解压流），生成 (字节数, 项目名)
+    """
+    with open_text(f_name) as f:
         for line in f:
-            res = {}
             r = line.rstrip().split(",", 2)
-            res["project"] = r[1]
-            res["value"] = int(r[0])/(1024**3)
-            res["date"] = s_date
-            res["environment"] = "k8s01"
-            logging.info(f"name: {r[1]}, value: {r[0]}, environment: k8s01, date: {s_date}")
-            l_res.append(res)
-    logging.info(l_res)
+            if len(r) < 2:
+                logging.warning(f"{f_name}: 忽略无效行 {line!r}")
+                continue
+            yield int(r[0]), r[1]
 
-    insert_to_mysql(l_res)
+# mmap 解析时每次切分的字节数
+MMAP_CHUNK = 8 * 1024 * 1024
 
-def extract_dates_from_files(directory="files"):
+def iter_records_mmap(f_name):
     """
-    从指定目录的文件名中提取日期
+    通过 mmap 按大块切分行，生成 (字节数, 项目名)
+    行切分在 C 层完成，数字直接从 bytes 解析，项目名按原始字节缓存解码结果，
+    重复的项目名不再分配新的 str
     """
-    if not os.path.exists(directory):
-        logging.info(f"目录 '{directory}' 不存在")
-        return
+    names = {}
+    with open(f_name, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos = 0
+            end = len(mm)
+            while pos < end:
+                # 切到块内最后一个换行符，保证不截断行
+                stop = min(pos + MMAP_CHUNK, end)
+                if stop < end:
+                    nl = mm.rfind(b"\n", pos, stop)
+                    stop = nl + 1 if nl != -1 else (mm.find(b"\n", stop) + 1 or end)
+                for line in mm[pos:stop].splitlines():
+                    r = line.split(b",", 2)
+                    if len(r) < 2:
+                        if line.strip():
+                            logging.warning(f"{f_name}: 忽略无效行 {line!r}")
+                        continue
+                    raw = r[1].rstrip()
+                    name = names.get(raw)
+                    if name is None:
+                        name = names[raw] = raw.decode("utf-8")
+                    yield int(r[0]), name
+                pos = stop
+
+def iter_records(f_name, reader="text"):
+    # 压缩文件只能流式解压，mmap 仅用于未压缩文件
+    if reader == "mmap" and not is_compressed(f_name):
+        return iter_records_mmap(f_name)
+    return iter_records_text(f_name)
 
-    for filename in os.listdir(directory):
+def aggregate_records(f_name, reader="text"):
+    """
+    按项目名累加同一文件中的字节数，返回 {项目名: 字节数}，按首次出现的顺序排列
+    字典大小只与项目数有关，与文件行数无关
+    """
+    totals = {}
+    for size, project in iter_records(f_name, reader):
+        totals[project] = totals.get(project, 0) + size
+    return totals
+
+def iter_rows(f_name, s_date, reader="text"):
+    """
+    解析数据文件，每个项目生成一条待插入的记录，不在内存中保留整个文件
+    (environment, date, project_name) 是 upsert 键，同一项目的多行必须先累加，
+    逐行写入时后一行会覆盖前一行
+    支持 .gz/.xz/.zst 压缩文件；未压缩文件可使用 mmap 解析
+    """
+    logging.info(f_name)
+    for project, size in aggregate_records(f_name, reader).items():
+        yield {
+            "project": project,
+            "value": size/(1024**3),
+            "date": s_date,
+            "environment": "k8s01",
+        }
+
+def batched(iterable, size):
+    """
+    将可迭代对象切分为固定大小的列表，最后一批可能不足 size
+    """
+    it = iter(iterable)
+    while True:
+        batch = list(islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+def handle_data(name, s_date, batch_size=DEFAULT_BATCH_SIZE, directory="files", manifest_path=DEFAULT_MANIFEST, reader="text"):
+    """
+    导入单个文件，返回本次写入的记录数（按项目累加后的条数），写入使用当前进程的 _writer
+    内容哈希与清单一致的文件直接跳过；上次中断的文件从已提交的记录数之后继续，
+    内容不变时累加结果的顺序不变，续传位置有效
+    """
+    if _writer is None:
+        init_writer()
+
+    start = time.monotonic()
+    f_name = os.path.join(directory, name)
+    manifest = Manifest(manifest_path)
+    st = os.stat(f_name)
+    sha256 = file_sha256(f_name)
+
+    rows_done = 0
+    record = manifest.get(name)
+    if record:
+        _, _, old_sha256, old_rows_done, status = record
+        if old_sha256 == sha256:
+            if status == "done":
+                # 只有 mtime 变化，内容未变
+                manifest.finish(name, st.st_size, st.st_mtime_ns, sha256, old_rows_done)
+                logging.info(f"{name}: 内容未变化，跳过")
+                return 0
+            rows_done = old_rows_done
+            logging.warning(f"{name}: 从第 {rows_done} 条记录继续导入")
+        elif status == "done":
+            logging.warning(f"{name}: 内容已变化，重新导入")
+
+    manifest.begin(name, st.st_size, st.st_mtime_ns, sha256, rows_done)
+
+    def on_commit(rows):
+        manifest.progress(name, rows_done + rows)
+
+    rows_iter = islice(iter_rows(f_name, s_date, reader), rows_done, None)
+    try:
+        rows = _writer.write_batches(batched(rows_iter, batch_size), on_commit)
+    except Exception as e:
+        logging.error(f"{name}: 写入失败: {e}")
+        raise
+    manifest.finish(name, st.st_size, st.st_mtime_ns, sha256, rows_done + rows)
+
+    elapsed = time.monotonic() - start
+    rate = rows / elapsed if elapsed > 0 else 0
+    logging.warning(f"{name}: 写入 {rows} 条记录, 耗时 {elapsed:.2f}s, {rate:.0f} rows/s")
+    return rows
+
+def list_files(directory="files"):
+    """
+    从指定目录的文件名中提取日期，返回 (文件名, 日期) 列表
+    """
+    jobs = []
+    for filename in sorted(os.listdir(directory)):
         # 查找文件名中的数字模式 MMdd
         match = re.search(r'(\d{2})(\d{2})', filename)
         if match:
@@ -49,46 +297,141 @@ def extract_dates_from_files(directory="files"):
                 date_str = date_obj.strftime("%Y-%m-%d")
                 logging.info(f"{filename} -> {date_str}")
             except ValueError:
-                logging.warn(f"{filename} -> 无效日期")
+                logging.warning(f"{filename} -> 无效日期")
+                continue
         else:
-            logging.warn(f"{filename} -> 无日期信息")
-
-        handle_data(filename, date_str)
-
-def insert_to_mysql(sql_data):
-    config = {
-        'host': '192.168.1.1',
-        'port': 3306,
-        'user': 'grafana',
-        'password': '123456',
-        'database': 'test',
-        'charset': 'utf8mb4',
-        'autocommit': True,
-    }
-    logging.info(sql_data)
+            logging.warning(f"{filename} -> 无日期信息")
+            continue
+        jobs.append((filename, date_str))
+    return jobs
+
+def pending_files(jobs, directory, manifest):
+    """
+    过滤掉大小和 mtime 与清单记录一致的已完成文件，只需 stat，不读文件内容
+    """
+    done = manifest.done_files()
+    pending = []
+    for filename, date_str in jobs:
+        st = os.stat(os.path.join(directory, filename))
+        if done.get(filename) == (st.st_size, st.st_mtime_ns):
+            logging.info(f"{filename}: 已导入，跳过")
+            continue
+        pending.append((filename, date_str))
+    return pending
+
+def extract_dates_from_files(directory="files", batch_size=DEFAULT_BATCH_SIZE, workers=1, mode="thread", db_connections=None, manifest_path=DEFAULT_MANIFEST, engine="executemany", rollups=True, reader="text"):
+    """
+    并发解析并导入目录中的所有文件
+        workers - 并发处理的文件数
+        mode - thread 或 process，process 模式下每个进程持有自己的写入器
+        db_connections - thread 模式下共享连接池的大小，默认等于 workers
+        manifest_path - 导入清单路径，已导入且未变化的文件会被跳过
+        engine - 写入方式，见 log_data.ENGINES
+        rollups - 是否在写入时同步刷新 log_data_daily/weekly/monthly 汇总表
+        reader - 未压缩文件的解析方式，text 或 mmap
+    """
+    if not os.path.exists(directory):
+        logging.info(f"目录 '{directory}' 不存在")
+        return
+
+    jobs = pending_files(list_files(directory), directory, Manifest(manifest_path))
+    if not jobs:
+        logging.warning("没有需要导入的文件")
+        return
+
+    # 主进程的写入器：thread 模式下由所有线程共享，process 模式下只用于建表
+    if mode == "process":
+        init_writer(1, engine, rollups)
+    else:
+        init_writer(min(workers, db_connections or workers), engine, rollups)
+    try:
+        # 断点续传和重跑都依赖 upsert，缺少唯一索引时直接退出，避免写入重复行
+        _writer.ensure_tables()
+    except RuntimeError as e:
+        logging.error(e)
+        _writer.close()
+        sys.exit(1)
+
+    total_rows = 0
+    start = time.monotonic()
+
+    if mode == "process":
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=init_writer, initargs=(1, engine, rollups))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers)
 
     try:
-        conn = pymysql.connect(**config)
+        with executor:
+            futures = {
+                executor.submit(handle_data, filename, date_str, batch_size, directory, manifest_path, reader): filename
+                for filename, date_str in jobs
+            }
+            for future in as_completed(futures):
+                try:
+                    total_rows += future.result()
+                except Exception as e:
+                    logging.error(f"{futures[future]} 导入失败: {e}")
+    finally:
+        if mode == "thread":
+            _writer.log_stats()
+        _writer.close()
+
+    elapsed = time.monotonic() - start
+    rate = total_rows / elapsed if elapsed > 0 else 0
+    logging.warning(f"合计写入 {total_rows} 条记录, 耗时 {elapsed:.2f}s, {rate:.0f} rows/s")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="导入日志大小数据到 log_data")
+    parser.add_argument("directory", nargs="?", default="files", help="数据文件目录")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="每批插入并提交的行数")
+    parser.add_argument("--workers", type=int, default=1, help="并发处理的文件数")
+    parser.add_argument("--mode", choices=["thread", "process"], default="thread", help="并发方式")
+    parser.add_argument("--db-connections", type=int, default=None, help="thread 模式下连接池大小，默认等于 --workers")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST, help="导入清单 (SQLite) 路径")
+    parser.add_argument("--engine", choices=log_data.ENGINES, default="executemany", help="写入方式")
+    parser.add_argument("--no-rollups", dest="rollups", action="store_false", help="写入时不刷新汇总表")
+    parser.add_argument("--reader", choices=READERS, default="text", help="未压缩文件的解析方式")
+    parser.add_argument("--init-rollups", action="store_true", help="创建汇总表并根据 log_data 全量重算后退出")
+    parser.add_argument("--init-upsert-key", action="store_true", help="为 log_data 添加 upsert 所需的唯一索引后退出")
+    return parser.parse_args()
+
+def init_rollups():
+    """
+    创建汇总表并全量重算
+    """
+    init_writer()
+    with _writer.pool.connection() as conn:
         with conn.cursor() as cursor:
-            sql = """
-            INSERT INTO log_data (environment, date, value, project_name) VALUES (%(environment)s, %(date)s, %(value)s, %(project)s)
-            """
-            # 使用 executemany 批量插入
-            logging.info(sql)
-            cursor.executemany(sql, sql_data)
-            logging.info(f"批量插入 {cursor.rowcount} 条记录")
+            log_data.ensure_rollup_tables(cursor)
+            log_data.rebuild_rollups(cursor)
         conn.commit()
-    except pymysql.MySQLError as e:
-        logging.error(f"MySQL 错误: {e}")
-        conn.rollback()  # 回滚事务
-    except Exception as e:
-        logging.error(f"其他错误: {e}")
-        conn.rollback()
+    _writer.close()
+    logging.warning("汇总表已重建")
+
+def init_upsert_key():
+    """
+    为 log_data 添加 (environment, date, project_name) 唯一索引
+    已有重复数据时 MySQL 会报 1062，需要先清理重复行
+    """
+    init_writer()
+    try:
+        with _writer.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                if log_data.has_upsert_key(cursor):
+                    logging.warning("log_data 已有 upsert 唯一索引")
+                    return
+                cursor.execute(log_data.UPSERT_KEY_DDL)
+            conn.commit()
+        logging.warning("已添加 log_data upsert 唯一索引")
     finally:
-        # 🧹 关闭连接
-        if conn:
-            conn.close()
+        _writer.close()
 
 # 使用示例
 if __name__ == "__main__":
-    extract_dates_from_files("files")
+    args = parse_args()
+    if args.init_upsert_key:
+        init_upsert_key()
+    elif args.init_rollups:
+        init_rollups()
+    else:
+        extract_dates_from_files(args.directory, args.batch_size, args.workers, args.mode, args.db_connections, args.manifest, args.engine, args.rollups, args.reader)
@@ -1,23 +1,27 @@
-{
-  "name": "my-service-2",
-  "host": "my-service-2",
-  "protocol": "http",
-  "port": 80,
-  "tags": [
-    "user-level"
-  ],
-  "enabled": true
-}
-
-
 #!/usr/bin/env python3
 # use for kong
 # copy service from source kong to target kong
+#
+# 按名称对比源/目标 Kong，只对有差异的 service/route 做 PUT 更新，可以反复执行
+#   python3 kong_init.py --source http://192.168.0.1:8001 --target http://192.168.0.2:8001 --dry-run
+#   python3 kong_init.py --target http://a:8001 --target http://b:8001   # 源读一次，并发同步到多个目标
+#   python3 kong_init.py --prune     # 同时删除目标上多出来的、带同步标签的对象
+#   python3 kong_init.py --export kong.jsonl.gz    # 源 Kong 全量导出为快照
+#   python3 kong_init.py --import kong.jsonl.gz    # 快照按 id 原样回放到目标 Kong
+#
+# 同步到目标的 service 形如:
+#   {"name": "my-service-2", "host": "my-service-2", "protocol": "http", "port": 8000, "tags": ["CMD"], "enabled": true}
 
-import json
-import logger
 import os
+import sys
+import gzip
+import json
+import time
+import logging
+import argparse
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 def create_logger(application, verbose=None):
     if verbose:
@@ -40,47 +44,387 @@ logger = create_logger(os.path.basename(sys.argv[0]), "debug")
 source_server = "http://192.168.0.1:8001"
 target_server = "http://192.168.0.2:8001"
 
-logger.info("===== begin =====")
-url = "{0}/services".format(source_server)
+# 同步标签、Admin API 每页条数
+SYNC_TAG = "CMD"
+PAGE_SIZE = 1000
+
+def make_session(workers):
+    # 带连接池的 Session，并发请求复用 keep-alive 连接
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def iter_pages(session, server, path):
+    """按 Kong 返回的 next/offset 逐页读取整个集合，逐条产出"""
+    url = "{0}{1}".format(server, path)
+    params = {"size": PAGE_SIZE}
+    while url:
+        logger.debug(url)
+        r = session.get(url, params=params)
+        r.raise_for_status()
+        res = r.json()
+        for item in res["data"]:
+            yield item
+        # next 形如 /services?offset=xxx，已经带了 size/offset 参数
+        url = "{0}{1}".format(server, res["next"]) if res.get("next") else None
+        params = None
 
-logger.debug(url)
-r = requests.get(url)
-res = json.loads(r.text)
+def paginate(session, server, path):
+    return list(iter_pages(session, server, path))
 
-for job in res["data"]:
-    if job["tags"][0] == "CMD":
-        host_name = job["host"]
-        name = job["name"]
+def load_kong(session, server):
+    """并发读取一个 Kong 的全部 service 和 route"""
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        services = executor.submit(paginate, session, server, "/services")
+        routes = executor.submit(paginate, session, server, "/routes")
+        return services.result(), routes.result()
 
-        data = {
-            "host": host_name,
+def desired_model(services, routes, tag=SYNC_TAG):
+    """
+    从源 Kong 的数据生成目标应有的状态
+    返回 ({service_name: payload}, {route_name: payload})，route 的 service 先用名称表示
+    """
+    want_services = {}
+    names_by_id = {}
+    for job in services:
+        if not job.get("tags") or job["tags"][0] != tag:
+            continue
+        names_by_id[job["id"]] = job["name"]
+        want_services[job["name"]] = {
+            "host": job["host"],
             "protocol": "http",
-            "name": name,
-            "port": "8000",
-            "tags": ["CMD"],
-            "enabled": true
+            "name": job["name"],
+            "port": 8000,
+            "tags": [tag],
+            "enabled": True
         }
 
-    # create service
-    url = "{0}/services".format(target_server)
-    r = requests.post(url, data=data)
-
-    # get service's router name
-    router_url = "{0}/services/{1}/routes".format(source_server, name)
-    r = requests.get(router_url)
-    route_data = json.loads(r.text)
-
-    for i in route_data["data"]:
-        route_name = i["name"]
-        route_path = i["paths"]
-        routes = {
-            "name": route_name,
-            "paths": route_path,
+    want_routes = {}
+    for i in routes:
+        service_name = names_by_id.get((i.get("service") or {}).get("id"))
+        if service_name is None:
+            continue
+        if not i.get("name"):
+            logger.warning("跳过未命名的 route: {0}".format(i["id"]))
+            continue
+        want_routes[i["name"]] = {
+            "name": i["name"],
+            "paths": i["paths"],
             "methods": ["GET", "POST"],
             "protocols": ["http"],
-            "tags": ["CMD"]
+            "tags": [tag],
+            "service": service_name
         }
 
-        url = "{0}/services/{1}/routes".format(target_server, name)
-        r = requests.post(url, data=routes)
-        print(r.status_code, r.text)
+    return want_services, want_routes
+
+def index_by_name(items):
+    return {i["name"]: i for i in items if i.get("name")}
+
+def differs(want, have, skip=()):
+    return any(have.get(k) != v for k, v in want.items() if k not in skip)
+
+class Plan(object):
+    """
+    同步计划，每项为 (name, payload)
+    payload 中 route 的 service 仍是名称，执行时再换成目标上的 id
+    """
+    def __init__(self):
+        self.create_services = []
+        self.update_services = []
+        self.delete_services = []
+        self.create_routes = []
+        self.update_routes = []
+        self.delete_routes = []
+
+    def empty(self):
+        return not any(vars(self).values())
+
+    def summary(self):
+        return ", ".join("{0}:{1}".format(k, len(v)) for k, v in vars(self).items())
+
+def plan_sync(want_services, want_routes, have_services, have_routes, tag=SYNC_TAG):
+    """对比期望状态与目标现状，生成最小的 create/update/delete 计划"""
+    plan = Plan()
+    have_services = index_by_name(have_services)
+    service_names = {s["id"]: s["name"] for s in have_services.values()}
+    have_routes = index_by_name(have_routes)
+
+    for name, want in want_services.items():
+        have = have_services.get(name)
+        if have is None:
+            plan.create_services.append((name, want))
+        elif differs(want, have):
+            plan.update_services.append((name, want))
+
+    for name, want in want_routes.items():
+        have = have_routes.get(name)
+        if have is None:
+            plan.create_routes.append((name, want))
+        elif differs(want, have, skip=("service",)) or \
+                service_names.get((have.get("service") or {}).get("id")) != want["service"]:
+            plan.update_routes.append((name, want))
+
+    # 只删除带同步标签的对象，不碰目标上手工维护的配置
+    for name, have in have_routes.items():
+        if name not in want_routes and tag in (have.get("tags") or []):
+            plan.delete_routes.append((name, None))
+    for name, have in have_services.items():
+        if name not in want_services and tag in (have.get("tags") or []):
+            plan.delete_services.append((name, None))
+
+    return plan
+
+def run_parallel(func, items, workers):
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=min(workers, len(items))) as executor:
+        return list(executor.map(func, items))
+
+def request_ok(r, action, name):
+    if r.ok:
+        logger.debug("{0} {1}: {2}".format(action, name, r.status_code))
+        return True
+    logger.error("{0} {1} 失败: {2} {3}".format(action, name, r.status_code, r.text))
+    return False
+
+def apply_plan(session, server, plan, workers, prune=False):
+    """
+    按依赖顺序执行计划：先 PUT service，再 PUT route，删除时反过来
+    PUT /{collection}/{name} 是按名称 upsert，重复执行结果一致
+    返回 (成功数, 失败数)
+    """
+    results = []
+
+    def put_service(item):
+        name, payload = item
+        r = session.put("{0}/services/{1}".format(server, name), json=payload)
+        return request_ok(r, "service", name) and r.json()
+
+    def put_route(item):
+        name, payload = item
+        payload = dict(payload, service={"id": service_ids[payload["service"]]})
+        r = session.put("{0}/routes/{1}".format(server, name), json=payload)
+        return request_ok(r, "route", name)
+
+    def delete(collection):
+        def _delete(item):
+            name, _ = item
+            r = session.delete("{0}/{1}/{2}".format(server, collection, name))
+            return request_ok(r, "delete " + collection[:-1], name)
+        return _delete
+
+    services = plan.create_services + plan.update_services
+    put = run_parallel(put_service, services, workers)
+    results.extend(bool(x) for x in put)
+
+    # route 需要目标上 service 的 id，只有用到的 service 才需要查
+    service_ids = {s["name"]: s["id"] for s in put if s}
+    missing = {p["service"] for _, p in plan.create_routes + plan.update_routes} - set(service_ids)
+    if missing:
+        service_ids.update({s["name"]: s["id"] for s in paginate(session, server, "/services") if s["name"] in missing})
+    routes = [(n, p) for n, p in plan.create_routes + plan.update_routes if p["service"] in service_ids]
+    results.extend([False] * (len(plan.create_routes) + len(plan.update_routes) - len(routes)))
+    results.extend(run_parallel(put_route, routes, workers))
+
+    if prune:
+        results.extend(run_parallel(delete("routes"), plan.delete_routes, workers))
+        results.extend(run_parallel(delete("services"), plan.delete_services, workers))
+
+    ok = sum(1 for x in results if x)
+    return ok, len(results) - ok
+
+# 快照按依赖顺序写入与回放：service -> route -> plugin
+SNAPSHOT_TYPES = (("service", "/services"), ("route", "/routes"), ("plugin", "/plugins"))
+# 由 Kong 维护的字段，回放时不带上
+READONLY_FIELDS = ("created_at", "updated_at")
+
+def open_snapshot(path, mode):
+    # .gz 结尾的文件按 gzip 读写
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+def export_snapshot(session, server, path):
+    """
+    把 service/route/plugin 流式写成 JSON Lines，每行 {"type": ..., "data": {...}}
+    逐页写出，内存里只保留一页
+    """
+    counts = {}
+    with open_snapshot(path, "w") as f:
+        for kind, collection in SNAPSHOT_TYPES:
+            counts[kind] = 0
+            for item in iter_pages(session, server, collection):
+                f.write(json.dumps({"type": kind, "data": item}, separators=(",", ":"), ensure_ascii=False))
+                f.write("\n")
+                counts[kind] += 1
+    return counts
+
+def iter_snapshot(path):
+    with open_snapshot(path, "r") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def import_snapshot(session, server, path, workers, dry_run=False):
+    """
+    按 id PUT 回放快照，id 与源一致，route/plugin 的外键无需转换，可重复执行
+    同一类型的对象并发写入，类型切换时等前一类全部完成，保证依赖顺序
+    dry_run 时只统计会写入的对象，不发请求
+    返回 ({type: 成功数}, 失败数)
+    """
+    counts = {kind: 0 for kind, _ in SNAPSHOT_TYPES}
+    collections = dict(SNAPSHOT_TYPES)
+    failed = [0]
+
+    def put(record):
+        kind, item = record["type"], dict(record["data"])
+        for field in READONLY_FIELDS:
+            item.pop(field, None)
+        url = "{0}{1}/{2}".format(server, collections[kind], item["id"])
+        if dry_run:
+            logger.debug("dry-run PUT {0}".format(url))
+            return kind
+        if request_ok(session.put(url, json=item), kind, item.get("name") or item["id"]):
+            return kind
+        return None
+
+    def drain(pending):
+        for future in pending:
+            kind = future.result()
+            if kind:
+                counts[kind] += 1
+            else:
+                failed[0] += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = []
+        current = None
+        for record in iter_snapshot(path):
+            if record["type"] not in collections:
+                logger.warning("跳过未知类型: {0}".format(record["type"]))
+                continue
+            if record["type"] == "plugin" and record["data"].get("consumer"):
+                # 快照不含 consumer，引用 consumer 的插件无法回放
+                logger.warning("跳过绑定 consumer 的插件: {0}".format(record["data"]["id"]))
+                continue
+            # 类型切换或在途请求过多时先等已提交的完成，内存与并发都有上限
+            if record["type"] != current or len(pending) >= workers * 4:
+                drain(pending)
+                pending = []
+                current = record["type"]
+            pending.append(executor.submit(put, record))
+        drain(pending)
+
+    return counts, failed[0]
+
+def log_plan(plan, prune, target):
+    for attr, items in vars(plan).items():
+        if attr.startswith("delete") and not prune:
+            continue
+        for name, _ in items:
+            logger.info("[{0}] {1}: {2}".format(target, attr, name))
+
+class TargetResult(object):
+    """单个目标的同步结果"""
+    def __init__(self, target):
+        self.target = target
+        self.plan = None
+        self.ok = 0
+        self.failed = 0
+        self.error = None
+        self.elapsed = 0.0
+
+    def __str__(self):
+        if self.error:
+            return "{0}: error {1} ({2:.1f}s)".format(self.target, self.error, self.elapsed)
+        plan = self.plan.summary() if self.plan else "-"
+        return "{0}: ok {1}, failed {2}, {3:.1f}s [{4}]".format(self.target, self.ok, self.failed, self.elapsed, plan)
+
+def sync_target(target, want_services, want_routes, args):
+    """
+    把源的期望状态同步到一个目标，每个目标使用自己的连接池和 worker 上限
+    源只在 main() 里读一次，这里只读目标自己的现状
+    """
+    result = TargetResult(target)
+    start = time.monotonic()
+    try:
+        session = make_session(args.workers)
+        target_services, target_routes = load_kong(session, target)
+        result.plan = plan_sync(want_services, want_routes, target_services, target_routes, args.tag)
+        logger.info("[{0}] plan: {1}".format(target, result.plan.summary()))
+        log_plan(result.plan, args.prune, target)
+        if not args.dry_run and not result.plan.empty():
+            result.ok, result.failed = apply_plan(session, target, result.plan, args.workers, args.prune)
+    except Exception as e:
+        logger.error("[{0}] 同步失败: {1}".format(target, e))
+        result.error = e
+    result.elapsed = time.monotonic() - start
+    return result
+
+def import_target(target, args):
+    result = TargetResult(target)
+    start = time.monotonic()
+    try:
+        counts, result.failed = import_snapshot(make_session(args.workers), target, args.import_file, args.workers, args.dry_run)
+        result.ok = sum(counts.values())
+        if args.dry_run:
+            logger.info("[{0}] dry-run: 将导入 {1}".format(target, counts))
+    except Exception as e:
+        logger.error("[{0}] 导入失败: {1}".format(target, e))
+        result.error = e
+    result.elapsed = time.monotonic() - start
+    return result
+
+def fan_out(func, targets, *args):
+    """所有目标并发处理，总耗时约等于最慢的那个目标"""
+    with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+        return list(executor.map(lambda target: func(target, *args), targets))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="按名称增量同步 Kong service/route")
+    parser.add_argument("--source", default=source_server, help="源 Kong Admin API 地址")
+    parser.add_argument("--target", action="append", help=f"目标 Kong Admin API 地址，可重复指定多个，默认 {target_server}")
+    parser.add_argument("--tag", default=SYNC_TAG, help=f"只同步第一个标签为此值的 service，默认 {SYNC_TAG}")
+    parser.add_argument("--workers", type=int, default=16, help="每个目标的并发请求数，默认 16")
+    parser.add_argument("--prune", action="store_true", help="删除目标上带同步标签、但源上已不存在的对象")
+    parser.add_argument("--dry-run", action="store_true", help="只打印同步计划，不修改目标；与 --import 同用时只统计快照中会写入的对象")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--export", metavar="FILE", help="把源 Kong 的 service/route/plugin 导出为 JSONL 快照（.gz 结尾则压缩）")
+    mode.add_argument("--import", dest="import_file", metavar="FILE", help="把快照按 id 回放到目标 Kong")
+    args = parser.parse_args()
+    if args.prune and (args.export or args.import_file):
+        # 导出/导入不做差异对比，--prune 不会生效
+        parser.error("--prune 不能与 --export/--import 同时使用")
+    # 去重并保持顺序
+    args.target = list(dict.fromkeys(args.target or [target_server]))
+    return args
+
+def main():
+    args = parse_args()
+
+    logger.info("===== begin =====")
+    if args.export:
+        counts = export_snapshot(make_session(args.workers), args.source, args.export)
+        logger.info("===== end: exported {0} to {1} =====".format(counts, args.export))
+        return
+
+    if args.import_file:
+        results = fan_out(import_target, args.target, args)
+    else:
+        # 源只读一次，期望状态在内存里给所有目标共用
+        source_services, source_routes = load_kong(make_session(args.workers), args.source)
+        want_services, want_routes = desired_model(source_services, source_routes, args.tag)
+        logger.info("source: {0} services, {1} routes".format(len(want_services), len(want_routes)))
+        results = fan_out(sync_target, args.target, want_services, want_routes, args)
+
+    for result in results:
+        logger.info(str(result))
+    logger.info("===== end =====")
+    if any(r.error or r.failed for r in results):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
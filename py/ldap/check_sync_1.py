@@ -1,13 +1,20 @@
 #!/usr/bin/env python
 
+import json
 import ldap
 import logging
 import os
 import sys
 import time
+import calendar
 import datetime
+import requests
 import yaml
 import re
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 def create_logger(application, verbose=None, logfile=None):
     if verbose:
@@ -70,7 +77,7 @@ def load_config(config_path: str) -> dict:
         except yaml.YAMLError as e:
             raise ValueError(f"YAML 格式错误: {e}")
 
-def ldap_connect(ldapuri, logger=None, binddn="", bindpw=""):
+def ldap_connect(ldapuri, logger=None, binddn="", bindpw="", timeout=None):
     ldap.set_option(ldap.OPT_DEBUG_LEVEL, 0)
     ldap_trace_level = 0
     ldap_trace_file = sys.stderr
@@ -87,6 +94,11 @@ def ldap_connect(ldapuri, logger=None, binddn="", bindpw=""):
         logger.debug("LDAP protocol version 3")
     conn.protocal_version = ldap.VERSION3
 
+    if timeout:
+        # 连接和单次操作都设超时，避免一个卡住的 consumer 拖住整个检查
+        conn.set_option(ldap.OPT_NETWORK_TIMEOUT, timeout)
+        conn.set_option(ldap.OPT_TIMEOUT, timeout)
+
     if binddn:
         password = bindpw
         if logger:
@@ -135,6 +147,17 @@ def contextCSN_to_datetime(contextCSN):
     gentime = re.sub('(\.\d{6})?Z.*$', '', contextCSN)
     return datetime.datetime.fromtimestamp(time.mktime(time.strptime(gentime,"%Y%m%d%H%M%S")))
 
+def contextCSN_to_timestamp(contextCSN):
+    """
+    Convert contextCSN string to epoch seconds
+        contextCSN - Timestamp in YYYYmmddHHMMSSZ#... format (string), always UTC
+
+    contextCSN_to_datetime reads the time as local time, which is fine for
+    differences but not for absolute timestamps
+    """
+    gentime = re.sub('(\.\d{6})?Z.*$', '', contextCSN)
+    return calendar.timegm(time.strptime(gentime, "%Y%m%d%H%M%S"))
+
 def threshold_to_datetime(threshold):
     """
     Convert threshold in seconds to datetime object
@@ -145,22 +168,18 @@ def threshold_to_datetime(threshold):
     nbdays, nbseconds = divmod(threshold, 86400)
     return datetime.timedelta(days=nbdays, seconds=nbseconds)
 
-def is_insynch(provldapobj, consldapobj, basedn, threshold=None, logger=None):
+def is_insynch(provcontextCSN, consldapobj, basedn, threshold=None, logger=None):
     """
     Check if the consumer is in synch with the provider within the threshold
-        provldapobj - Provider LDAP object instance
+        provcontextCSN - Provider contextCSN, fetched once per run (string)
         consldapobj - Consumer LDAP object instance
         basedn - LDAP base dn (string)
         threshold - limit above which provider and consumer are not considered
         in synch (int)
 
-        This function returns False if the provider and the consumer is not
-        in synch, True if in synch within the threshold
+        This function returns (insync, delta): insync is False if the provider
+        and the consumer is not in synch, True if in synch within the threshold
     """
-    if logger:
-        logger.debug("Retrieving Provider contextCSN")
-    provcontextCSN = get_contextCSN(provldapobj, basedn, logger)
-
     if logger:
         logger.debug("Retrieving Consumer contextCSN")
     conscontextCSN = get_contextCSN(consldapobj, basedn, logger)
@@ -169,33 +188,88 @@ def is_insynch(provldapobj, consldapobj, basedn, threshold=None, logger=None):
         if (provcontextCSN == conscontextCSN):
             if logger:
                 logger.info("OK Provider and consumer exactly in SYNCH")
-            return True
+            return True, datetime.timedelta(0)
         else:
             delta = contextCSN_to_datetime(provcontextCSN) - contextCSN_to_datetime(conscontextCSN)
             LdapDelta= f"Delta is: {delta}"
             logger.info(LdapDelta)
 
             if threshold:
-                maxdelta = threshold_to_datetime(eval(threshold))
+                maxdelta = threshold_to_datetime(int(threshold))
                 if logger:
                     logger.debug(f"Threshold is {maxdelta}")
                 if (abs(delta) <= maxdelta):
                     if logger:
                         logger.info(" Consumer is SYNCH within threshold")
                         logger.info(f" Deta is {delta}")
+                    return True, delta
                 else:
                     if logger:
-                        logger.warn(" Consumer NOT in SYNCH within threshold")
-                    return False
+                        logger.warning(" Consumer NOT in SYNCH within threshold")
+                    return False, delta
             else:
                 if logger:
                     logger.error("NOT SET threshold")
                     logger.error(f" Delta is {delta}")
-                return True
+                return True, delta
     else:
         if logger:
             logger.error(" Check failed: at least one contextCSN value is missing")
-    return False
+    return False, None
+
+class CheckResult(object):
+    """
+    单个 consumer 的检查结果
+        insync  - True/False，检查没有完成时为 None
+        delta   - 与 provider 的 contextCSN 时间差
+        error   - 连接失败、超时等错误信息
+        checked - 是否开始过检查，排队时被取消的 consumer 为 False，不告警
+    """
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.insync = None
+        self.delta = None
+        self.error = None
+        self.elapsed = 0.0
+        self.checked = True
+
+    def failed(self):
+        return self.checked and (self.error is not None or not self.insync)
+
+    def __str__(self):
+        if not self.checked:
+            return f"{self.consumer}: NOT CHECKED"
+        if self.error:
+            return f"{self.consumer}: FAILED {self.error} ({self.elapsed:.1f}s)"
+        state = "SYNCH" if self.insync else "NOT SYNCH"
+        return f"{self.consumer}: {state} delta={self.delta} ({self.elapsed:.1f}s)"
+
+def check_consumer(consumer, provcontextCSN, timeout=None):
+    result = CheckResult(consumer)
+    start = time.monotonic()
+    if logger:
+        logger.info(f"Checking if consumer {consumer} is in SYNCH with provider")
+
+    ldapcons = ldap_connect(
+        consumer,
+        logger,
+        config['binddn'],
+        config['passwd'],
+        timeout,
+    )
+
+    if ldapcons:
+        try:
+            result.insync, result.delta = is_insynch(provcontextCSN, ldapcons, config['basedn'], config['threshold'], logger)
+        except ldap.LDAPError as e:
+            result.error = f"search failed: {e}"
+        finally:
+            ldapcons.unbind_s()
+    else:
+        result.error = "bind failed"
+
+    result.elapsed = time.monotonic() - start
+    return result
 
 def main():
     if logger:
@@ -205,38 +279,272 @@ def main():
         ldapuri = config['prov'],
         logger = logger,
         binddn = config['binddn'],
-        bindpw = config['passwd']
+        bindpw = config['passwd'],
+        timeout = config.get('timeout', 10)
     )
 
-    if ldapprov:
-        for consumer in config["cons"]:
-            if logger:
-                logger.info(f"Checking if consumer {consumer} is in SYNCH with provider")
-
-            ldapcons = ldap_connect(
-                consumer,
-                logger,
-                config['binddn'],
-                config['passwd'],
-            )
-
-            if ldapcons:
-                IsInSync = is_insynch(ldapprov, ldapcons, config['basedn'], config['threshold'], logger)
-                ldapcons.unbind_s()
-                logger.warn(IsInSync)
-                if not IsInSync:
-                    create_alert(consumer)
-            else:
-                sys.exit()
+    if not ldapprov:
+        sys.exit(1)
 
+    # provider 的 contextCSN 每次运行只取一次，所有 consumer 都和它比较
+    if logger:
+        logger.debug("Retrieving Provider contextCSN")
+    try:
+        provcontextCSN = get_contextCSN(ldapprov, config['basedn'], logger)
+    finally:
         ldapprov.unbind_s()
-    else:
-        sys.exit(1)
+
+    consumers = config["cons"]
+    timeout = config.get('timeout', 10)
+    # LDAP 选项的超时之外再兜底一次：bind + search 各一次，从该 consumer 开始检查时计时
+    deadline = timeout * 2 + 5
+    workers = min(config.get('workers', 16), len(consumers)) or 1
+    started = {}
+
+    def run_check(consumer):
+        started[consumer] = time.monotonic()
+        return check_consumer(consumer, provcontextCSN, timeout)
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {executor.submit(run_check, consumer): consumer for consumer in consumers}
+
+    pending = set(futures)
+    hung = set()
+    while pending:
+        _, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+        now = time.monotonic()
+        expired = {f for f in pending if futures[f] in started and now - started[futures[f]] > deadline}
+        hung |= expired
+        pending -= expired
+        if pending and len(hung) >= workers:
+            # 所有 worker 都卡住了，排队的 consumer 不会再开始
+            break
+    # 取消还在排队的检查，卡住的线程不再等待
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for future, consumer in futures.items():
+        result = CheckResult(consumer)
+        if future in hung:
+            result.error = "timeout"
+            result.elapsed = time.monotonic() - started[consumer]
+        elif future.done() and not future.cancelled():
+            try:
+                result = future.result()
+            except Exception as e:
+                result.error = str(e)
+        else:
+            result.checked = False
+        results.append(result)
+
+    for result in results:
+        if result.failed():
+            logger.warning(str(result))
+            create_alert(result.consumer)
+        elif not result.checked:
+            logger.warning(str(result))
+        else:
+            logger.info(str(result))
+
+    if logger:
+        logger.info("====== end ======")
+
+    code = 2 if any(r.error or not r.checked for r in results) else 0
+    if hung:
+        # 解释器退出时会 join 线程池的线程，卡住的检查会让进程一直不退出，直接结束进程
+        logging.shutdown()
+        os._exit(code)
+    if code:
+        sys.exit(code)
+
+def contextCSN_by_serverid(values):
+    """
+    把多值 contextCSN 按 serverID 分组
+        values - contextCSN 原始值列表 (bytes/str)，形如 YYYYmmddHHMMSS.ffffffZ#count#sid#mod
+    返回 {serverid(int): contextCSN(str)}，sid 在 CSN 中是十六进制
+    """
+    csns = {}
+    for value in values:
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        parts = value.split('#')
+        if len(parts) < 3:
+            continue
+        csns[int(parts[2], 16)] = value
+    return csns
+
+class PersistentConnection(object):
+    """
+    常驻的已认证 LDAP 连接，查询失败时丢弃连接并重连重试一次
+    """
+    def __init__(self, uri, binddn, bindpw, timeout=None):
+        self.uri = uri
+        self.binddn = binddn
+        self.bindpw = bindpw
+        self.timeout = timeout
+        self.conn = None
+        self.binds = 0
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = ldap_connect(self.uri, logger, self.binddn, self.bindpw, self.timeout)
+            if self.conn is None:
+                raise ldap.SERVER_DOWN({"desc": f"bind to {self.uri} failed"})
+            self.binds += 1
+        return self.conn
+
+    def close(self):
+        if self.conn is not None:
+            try:
+                self.conn.unbind_s()
+            except ldap.LDAPError:
+                pass
+            self.conn = None
+
+    def contextCSNs(self, basedn):
+        for attempt in range(2):
+            try:
+                result_list = ldap_search(self.connect(), basedn, ldap.SCOPE_BASE, '(objectclass=*)', ['contextCSN'])
+                return contextCSN_by_serverid(result_list[0][1].get("contextCSN", []))
+            except ldap.LDAPError as e:
+                # 连接断开、超时等都重建连接；第二次仍失败则交给调用方记为 down
+                logger.warning(f"{self.uri} 查询 contextCSN 失败: {e}")
+                self.close()
+                if attempt:
+                    raise
+
+class LagExporter(object):
+    """
+    定时轮询 provider/consumer 的 contextCSN，按 consumer 和 serverID 计算复制延迟
+    指标文本在每轮结束后整体替换，HTTP 请求只读缓存，不会触发 LDAP 查询
+    """
+    def __init__(self, config, interval):
+        timeout = config.get('timeout', 10)
+        self.basedn = config['basedn']
+        self.threshold = int(config['threshold']) if config.get('threshold') else None
+        self.interval = interval
+        self.provider = PersistentConnection(config['prov'], config['binddn'], config['passwd'], timeout)
+        self.consumers = [PersistentConnection(c, config['binddn'], config['passwd'], timeout) for c in config['cons']]
+        self.executor = ThreadPoolExecutor(max_workers=min(config.get('workers', 16), len(self.consumers) + 1))
+        self.metrics = ""
+        self.lock = threading.Lock()
+
+    def fetch(self, server):
+        try:
+            return server.contextCSNs(self.basedn)
+        except ldap.LDAPError:
+            return None
+
+    def poll(self):
+        start = time.monotonic()
+        servers = [self.provider] + self.consumers
+        csns = dict(zip(servers, self.executor.map(self.fetch, servers)))
+
+        lines = []
+        def metric(name, help, kind, samples):
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label}}} {value}" if label else f"{name} {value}")
+
+        metric("ldap_up", "1 if the contextCSN of the server could be read", "gauge",
+               [({"instance": s.uri}, int(csns[s] is not None)) for s in servers])
+        metric("ldap_contextcsn_timestamp_seconds", "contextCSN time per serverID", "gauge",
+               [({"instance": s.uri, "serverid": sid}, contextCSN_to_timestamp(csn))
+                for s in servers if csns[s] for sid, csn in sorted(csns[s].items())])
+        metric("ldap_binds_total", "LDAP binds performed by the exporter, including reconnects", "counter",
+               [({"instance": s.uri}, s.binds) for s in servers])
+
+        prov = csns[self.provider] or {}
+        lags, consumer_lags, insync = [], [], []
+        for server in self.consumers:
+            cons = csns[server]
+            if not prov or cons is None:
+                continue
+            worst = 0.0
+            missing = False
+            for sid, csn in sorted(prov.items()):
+                if sid in cons:
+                    lag = contextCSN_to_timestamp(csn) - contextCSN_to_timestamp(cons[sid])
+                else:
+                    # consumer 没有该 serverID 的 CSN，说明还没有同步到这个 provider 的任何修改，
+                    # 延迟至少是 provider 这条 CSN 距今的时间，且无论阈值如何都算不同步
+                    lag = max(0.0, time.time() - contextCSN_to_timestamp(csn))
+                    missing = True
+                lags.append(({"consumer": server.uri, "serverid": sid}, lag))
+                worst = max(worst, lag)
+            consumer_lags.append(({"consumer": server.uri}, worst))
+            if self.threshold is not None:
+                insync.append(({"consumer": server.uri}, int(not missing and worst <= self.threshold)))
+
+        metric("ldap_replication_lag_seconds", "provider contextCSN minus consumer contextCSN per serverID", "gauge", lags)
+        metric("ldap_replication_consumer_lag_seconds", "max replication lag of the consumer over all serverIDs", "gauge", consumer_lags)
+        if self.threshold is not None:
+            metric("ldap_replication_in_sync", "1 if the consumer lag is within the threshold", "gauge", insync)
+        metric("ldap_exporter_poll_duration_seconds", "duration of the last poll", "gauge",
+               [({}, round(time.monotonic() - start, 3))])
+
+        with self.lock:
+            self.metrics = "\n".join(lines) + "\n"
+
+    def run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"poll failed: {e}")
+            time.sleep(max(0, self.interval - (time.monotonic() - started)))
+
+    def render(self):
+        with self.lock:
+            return self.metrics
+
+def serve_metrics(exporter, address, port):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = exporter.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((address, port), MetricsHandler)
+    logger.info(f"metrics on http://{address}:{port}/metrics")
+    server.serve_forever()
+
+def run_daemon(interval, address, port):
+    exporter = LagExporter(config, interval)
+    exporter.poll()
+    threading.Thread(target=exporter.run, daemon=True).start()
+    serve_metrics(exporter, address, port)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="检查 OpenLDAP consumer 与 provider 的同步状态")
+    parser.add_argument("--config", default="config.yaml", help="配置文件，默认 config.yaml")
+    parser.add_argument("--daemon", action="store_true", help="常驻运行，以 Prometheus 格式暴露复制延迟")
+    parser.add_argument("--interval", type=float, default=15, help="daemon 模式下轮询 contextCSN 的间隔秒数，默认 15")
+    parser.add_argument("--listen", default="0.0.0.0", help="metrics 监听地址，默认 0.0.0.0")
+    parser.add_argument("--port", type=int, default=9330, help="metrics 端口，默认 9330")
+    return parser.parse_args()
 
 if __name__ == '__main__':
-    logger = create_logger("ldap_checker", verbose=True)
+    args = parse_args()
+    logger = create_logger("ldap_checker", verbose=not args.daemon)
     try:
-        config = load_config("config.yaml")
+        config = load_config(args.config)
     except (FileNotFoundError, ValueError) as e:
         logger.error(f"❌ 配置加载失败: {e}")
-    main()
+        sys.exit(1)
+    if args.daemon:
+        run_daemon(args.interval, args.listen, args.port)
+    else:
+        main()
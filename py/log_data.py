@@ -0,0 +1,419 @@
+# log_data 表的写入方式与连接池，供 handle_log.py 和 get_logs_size.py 共用
+
+import os
+import time
+import queue
+import logging
+import datetime
+import tempfile
+import threading
+import pymysql
+from contextlib import contextmanager
+
+# 连接参数，可通过 LOG_DATA_MYSQL_* 环境变量覆盖
+MYSQL_CONFIG = {
+    'host': os.environ.get('LOG_DATA_MYSQL_HOST', '192.168.1.1'),
+    'port': int(os.environ.get('LOG_DATA_MYSQL_PORT', 3306)),
+    'user': os.environ.get('LOG_DATA_MYSQL_USER', 'grafana'),
+    'password': os.environ.get('LOG_DATA_MYSQL_PASSWORD', '123456'),
+    'database': os.environ.get('LOG_DATA_MYSQL_DATABASE', 'test'),
+    'charset': 'utf8mb4',
+    'autocommit': False,
+}
+
+# 行字典的键与 log_data 列的对应关系
+COLUMNS = (
+    ("environment", "environment"),
+    ("date", "date"),
+    ("value", "value"),
+    ("project", "project_name"),
+)
+
+# 服务端或客户端禁用了 LOAD DATA LOCAL 时返回的错误码
+LOCAL_INFILE_DISABLED = {1148, 2068, 3948}
+
+# 每条多行 INSERT 包含的行数，避免超过 max_allowed_packet
+MULTIROW_CHUNK = 1000
+
+ENGINES = ("executemany", "multirow", "loaddata")
+
+# 本进程内 LOAD DATA LOCAL 不可用时置为 True，后续直接走多行 INSERT
+_loaddata_disabled = False
+
+# upsert 以 (environment, date, project_name) 为键，log_data 需要对应的唯一索引，
+# 没有该索引时 ON DUPLICATE KEY UPDATE 等同于普通 INSERT，重跑/续传会产生重复行
+# 已有重复数据时需先清理，否则建索引会失败
+# 同一次写入中每个键只能出现一次，否则后一行会覆盖前一行，调用方需先按键累加
+UPSERT_KEY = ("environment", "date", "project_name")
+UPSERT_KEY_DDL = "ALTER TABLE log_data ADD UNIQUE KEY uk_log_data_env_date_project (environment, date, project_name)"
+UPSERT_SUFFIX = " ON DUPLICATE KEY UPDATE value = VALUES(value)"
+
+# 可重试的错误：锁等待超时、死锁、连接失败/断开、连接数过多
+TRANSIENT_ERRORS = {1040, 1205, 1213, 2003, 2006, 2013}
+
+def connect_args(engine):
+    """
+    返回使用指定写入方式时需要附加到 pymysql.connect 的参数
+    """
+    return {"local_infile": True} if engine == "loaddata" else {}
+
+def write_executemany(cursor, rows, table="log_data", upsert=False):
+    columns = ", ".join(col for _, col in COLUMNS)
+    values = ", ".join(f"%({key})s" for key, _ in COLUMNS)
+    sql = f"INSERT INTO {table} ({columns}) VALUES ({values})"
+    if upsert:
+        sql += UPSERT_SUFFIX
+    cursor.executemany(sql, rows)
+    return len(rows)
+
+def write_multirow(cursor, rows, table="log_data", upsert=False, chunk=MULTIROW_CHUNK):
+    """
+    拼接 INSERT ... VALUES (...),(...) 多行语句写入
+    """
+    columns = ", ".join(col for _, col in COLUMNS)
+    placeholder = "(" + ", ".join(["%s"] * len(COLUMNS)) + ")"
+    for i in range(0, len(rows), chunk):
+        part = rows[i:i+chunk]
+        sql = f"INSERT INTO {table} ({columns}) VALUES " + ", ".join([placeholder] * len(part))
+        if upsert:
+            sql += UPSERT_SUFFIX
+        args = [row[key] for row in part for key, _ in COLUMNS]
+        cursor.execute(sql, args)
+    return len(rows)
+
+def _tsv_field(value):
+    # 按 LOAD DATA 默认的转义规则处理反斜杠、制表符和换行
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n")
+
+def write_loaddata(cursor, rows, table="log_data", upsert=False):
+    """
+    将行写入临时 TSV 文件，再通过 LOAD DATA LOCAL INFILE 导入
+    连接需要以 local_infile=True 建立；upsert 时使用 REPLACE 覆盖已有行
+    """
+    columns = ", ".join(col for _, col in COLUMNS)
+    fd, path = tempfile.mkstemp(prefix="log_data_", suffix=".tsv")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8", newline="\n") as f:
+            for row in rows:
+                f.write("\t".join(_tsv_field(row[key]) for key, _ in COLUMNS))
+                f.write("\n")
+        sql = (
+            f"LOAD DATA LOCAL INFILE %s {'REPLACE ' if upsert else ''}INTO TABLE {table} CHARACTER SET utf8mb4 "
+            r"FIELDS TERMINATED BY '\t' ESCAPED BY '\\' LINES TERMINATED BY '\n' "
+            f"({columns})"
+        )
+        cursor.execute(sql, (path,))
+    finally:
+        os.unlink(path)
+    return len(rows)
+
+def write_rows(cursor, rows, engine="executemany", table="log_data", upsert=False):
+    """
+    按指定方式写入一批行，返回写入的行数
+    loaddata 不可用时自动回退到多行 INSERT
+    """
+    global _loaddata_disabled
+
+    if engine == "loaddata" and not _loaddata_disabled:
+        try:
+            return write_loaddata(cursor, rows, table, upsert)
+        except pymysql.MySQLError as e:
+            if not e.args or e.args[0] not in LOCAL_INFILE_DISABLED:
+                raise
+            logging.warning(f"LOAD DATA LOCAL 不可用，回退到多行 INSERT: {e}")
+            _loaddata_disabled = True
+
+    if engine in ("loaddata", "multirow"):
+        return write_multirow(cursor, rows, table, upsert)
+    return write_executemany(cursor, rows, table, upsert)
+
+# 汇总表：daily 由 log_data 计算，weekly/monthly 由 daily 计算
+# 刷新 daily 时按 (environment, date, project_name) 过滤 log_data，建议建立索引:
+#   CREATE INDEX idx_log_data_env_date_project ON log_data (environment, date, project_name)
+ROLLUP_TABLES = ("log_data_daily", "log_data_weekly", "log_data_monthly")
+
+ROLLUP_DDL = """
+CREATE TABLE IF NOT EXISTS {table} (
+    period_start DATE NOT NULL,
+    environment VARCHAR(64) NOT NULL,
+    project_name VARCHAR(255) NOT NULL,
+    value_sum DOUBLE NOT NULL,
+    value_max DOUBLE NOT NULL,
+    samples INT NOT NULL,
+    PRIMARY KEY (period_start, environment, project_name)
+)
+"""
+
+ROLLUP_UPSERT = """
+ON DUPLICATE KEY UPDATE value_sum = VALUES(value_sum), value_max = VALUES(value_max), samples = VALUES(samples)
+"""
+
+# 每条汇总语句 IN 列表中的项目数
+ROLLUP_CHUNK = 500
+
+def _to_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value))
+
+def _period_start(table, day):
+    if table == "log_data_weekly":
+        return day - datetime.timedelta(days=day.weekday())
+    if table == "log_data_monthly":
+        return day.replace(day=1)
+    return day
+
+def _period_end(table, start):
+    if table == "log_data_weekly":
+        return start + datetime.timedelta(days=6)
+    if table == "log_data_monthly":
+        next_month = (start.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        return next_month - datetime.timedelta(days=1)
+    return start
+
+def has_upsert_key(cursor, table="log_data"):
+    """
+    检查表上是否存在列集合恰为 UPSERT_KEY 的唯一索引（含主键）
+    """
+    cursor.execute(f"SHOW INDEX FROM {table}")
+    names = [d[0] for d in cursor.description]
+    keys = {}
+    for row in cursor.fetchall():
+        index = dict(zip(names, row))
+        if int(index["Non_unique"]) == 0:
+            keys.setdefault(index["Key_name"], set()).add(index["Column_name"])
+    return set(UPSERT_KEY) in keys.values()
+
+def ensure_rollup_tables(cursor):
+    for table in ROLLUP_TABLES:
+        cursor.execute(ROLLUP_DDL.format(table=table))
+
+def rebuild_rollups(cursor):
+    """
+    根据 log_data 全量重算所有汇总表，用于首次启用或数据修复
+    """
+    cursor.execute(
+        "INSERT INTO log_data_daily (period_start, environment, project_name, value_sum, value_max, samples) "
+        "SELECT date, environment, project_name, SUM(value), MAX(value), COUNT(*) FROM log_data "
+        "GROUP BY date, environment, project_name" + ROLLUP_UPSERT
+    )
+    periods = {
+        "log_data_weekly": "DATE_SUB(period_start, INTERVAL WEEKDAY(period_start) DAY)",
+        "log_data_monthly": "DATE_FORMAT(period_start, '%Y-%m-01')",
+    }
+    for table, expr in periods.items():
+        cursor.execute(
+            f"INSERT INTO {table} (period_start, environment, project_name, value_sum, value_max, samples) "
+            f"SELECT {expr} AS p, environment, project_name, SUM(value_sum), MAX(value_max), SUM(samples) "
+            f"FROM log_data_daily GROUP BY p, environment, project_name" + ROLLUP_UPSERT
+        )
+
+def refresh_rollups(cursor, rows):
+    """
+    重算本批行涉及的 (环境, 周期, 项目) 汇总值，重复执行结果不变
+    应在写入 rows 的同一事务中调用
+    """
+    touched = {}
+    for row in rows:
+        key = (row["environment"], _to_date(row["date"]))
+        touched.setdefault(key, set()).add(row["project"])
+
+    for table in ROLLUP_TABLES:
+        periods = {}
+        for (environment, day), projects in touched.items():
+            key = (environment, _period_start(table, day))
+            periods.setdefault(key, set()).update(projects)
+
+        for (environment, start), projects in periods.items():
+            projects = sorted(projects)
+            end = _period_end(table, start)
+            for i in range(0, len(projects), ROLLUP_CHUNK):
+                part = projects[i:i+ROLLUP_CHUNK]
+                placeholders = ", ".join(["%s"] * len(part))
+                if table == "log_data_daily":
+                    sql = (
+                        "INSERT INTO log_data_daily (period_start, environment, project_name, value_sum, value_max, samples) "
+                        "SELECT date, environment, project_name, SUM(value), MAX(value), COUNT(*) FROM log_data "
+                        f"WHERE environment = %s AND date = %s AND project_name IN ({placeholders}) "
+                        "GROUP BY date, environment, project_name" + ROLLUP_UPSERT
+                    )
+                    args = [environment, start, *part]
+                else:
+                    sql = (
+                        f"INSERT INTO {table} (period_start, environment, project_name, value_sum, value_max, samples) "
+                        "SELECT %s, environment, project_name, SUM(value_sum), MAX(value_max), SUM(samples) FROM log_data_daily "
+                        f"WHERE environment = %s AND period_start BETWEEN %s AND %s AND project_name IN ({placeholders}) "
+                        "GROUP BY environment, project_name" + ROLLUP_UPSERT
+                    )
+                    args = [start, environment, start, end, *part]
+                cursor.execute(sql, args)
+
+class ConnectionPool:
+    """
+    有上限的 MySQL 连接池，连接按需创建并复用
+    """
+    def __init__(self, config, size):
+        self.config = config
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        while True:
+            try:
+                return self._idle.get_nowait()
+            except queue.Empty:
+                pass
+            with self._lock:
+                if self._created < self.size:
+                    self._created += 1
+                    try:
+                        return pymysql.connect(**self.config)
+                    except Exception:
+                        self._created -= 1
+                        raise
+            # 连接数已达上限，等待其他线程归还；被丢弃的连接会腾出名额，因此定期重试
+            try:
+                return self._idle.get(timeout=1)
+            except queue.Empty:
+                continue
+
+    def _discard(self, conn):
+        with self._lock:
+            self._created -= 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            conn.ping(reconnect=True)
+            yield conn
+        except Exception:
+            # 出错的连接状态未知，直接丢弃
+            self._discard(conn)
+            raise
+        else:
+            self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+def is_transient(e):
+    if isinstance(e, pymysql.err.InterfaceError):
+        return True
+    return isinstance(e, pymysql.MySQLError) and bool(e.args) and e.args[0] in TRANSIENT_ERRORS
+
+class LogDataWriter:
+    """
+    log_data 的共享写入器：连接池 + 按批 upsert + 瞬时错误重试 + 统计
+    每批在一个事务中写入并刷新汇总表，失败时整批回滚后重试，重试耗尽则抛出异常
+        pool_size - 连接池大小，多线程共享同一个 writer 时应不小于线程数
+        engine - executemany / multirow / loaddata
+        rollups - 是否在同一事务中刷新汇总表
+        retries - 每批最多重试次数，间隔为 backoff * 2^n 秒
+    """
+    def __init__(self, config=None, pool_size=1, engine="executemany", rollups=True, retries=3, backoff=1.0):
+        self.engine = engine
+        self.rollups = rollups
+        self.retries = retries
+        self.backoff = backoff
+        self.pool = ConnectionPool(dict(config or MYSQL_CONFIG, **connect_args(engine)), pool_size)
+        self._lock = threading.Lock()
+        self._stats = {"rows": 0, "batches": 0, "retries": 0, "failures": 0, "latency": 0.0, "max_latency": 0.0}
+
+    def _count(self, **delta):
+        with self._lock:
+            for key, value in delta.items():
+                if key == "max_latency":
+                    self._stats[key] = max(self._stats[key], value)
+                else:
+                    self._stats[key] += value
+
+    def ensure_tables(self, require_upsert_key=True):
+        """
+        启动时检查 upsert 唯一索引，并按需创建汇总表
+            require_upsert_key - 缺少索引时抛出 RuntimeError；为 False 时只记录错误日志
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cursor:
+                if not has_upsert_key(cursor):
+                    message = f"log_data 缺少 ({', '.join(UPSERT_KEY)}) 唯一索引，重复写入会产生重复行，请先执行: {UPSERT_KEY_DDL}"
+                    if require_upsert_key:
+                        raise RuntimeError(message)
+                    logging.error(message)
+                if self.rollups:
+                    ensure_rollup_tables(cursor)
+            conn.commit()
+
+    def write(self, rows):
+        """
+        写入一批行，返回行数
+        """
+        if not rows:
+            return 0
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                with self.pool.connection() as conn:
+                    try:
+                        with conn.cursor() as cursor:
+                            write_rows(cursor, rows, self.engine, upsert=True)
+                            if self.rollups:
+                                refresh_rollups(cursor, rows)
+                        conn.commit()
+                    except Exception:
+                        conn.rollback()
+                        raise
+            except Exception as e:
+                if attempt >= self.retries or not is_transient(e):
+                    self._count(failures=1)
+                    raise
+                delay = self.backoff * 2 ** attempt
+                attempt += 1
+                self._count(retries=1)
+                logging.warning(f"写入 log_data 失败: {e}，{delay:.1f}s 后第 {attempt} 次重试")
+                time.sleep(delay)
+                continue
+            elapsed = time.monotonic() - start
+            self._count(rows=len(rows), batches=1, latency=elapsed, max_latency=elapsed)
+            return len(rows)
+
+    def write_batches(self, batches, on_commit=None):
+        """
+        逐批写入，每批提交后以累计行数回调 on_commit，返回总行数
+        """
+        rows = 0
+        for batch in batches:
+            rows += self.write(batch)
+            if on_commit:
+                on_commit(rows)
+        return rows
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats["avg_latency"] = stats["latency"] / stats["batches"] if stats["batches"] else 0.0
+        return stats
+
+    def log_stats(self):
+        s = self.stats()
+        logging.warning(
+            f"log_data 写入统计: {s['rows']} 行, {s['batches']} 批, 重试 {s['retries']} 次, 失败 {s['failures']} 批, "
+            f"批延迟 平均 {s['avg_latency']*1000:.0f}ms 最大 {s['max_latency']*1000:.0f}ms"
+        )
+
+    def close(self):
+        self.pool.close()
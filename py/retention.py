@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# coding=utf-8
+# 镜像标签保留策略，acr.py 与 clean_nexus_image.py 共用
+#
+# 规则按顺序匹配，标签归入第一条匹配的规则，不匹配任何规则的标签一律保留
+#   name     - 分类名，用于统计输出
+#   pattern  - 正则，re.search 匹配标签
+#   keep     - 按排序保留最新的 N 个
+#   max_age  - 保留最近 N 天内推送的标签（需要后端提供时间）
+#   sort     - build / semver / natural / time / order
+#   build    - sort=build 时提取构建号的正则，取第一个分组，默认取标签里最后一段数字
+# keep 与 max_age 任一满足即保留，两者都未配置时整类保留
+# 排序键解析失败（没有构建号、不是 semver、缺少时间）的标签不参与排名，直接保留
+#
+# 示例 (JSON / YAML 均可):
+#   [{"name": "merge", "pattern": "merge", "keep": 30, "sort": "build"},
+#    {"name": "release", "pattern": "^v\\d", "keep": 10, "max_age": 90, "sort": "semver"}]
+
+import re
+import json
+import time
+
+SORTS = ("build", "semver", "natural", "time", "order")
+
+LAST_NUMBER = r"(\d+)(?!.*\d)"
+SEMVER = re.compile(r"(\d+)\.(\d+)\.(\d+)(?:-([0-9A-Za-z.-]+))?")
+NATURAL = re.compile(r"(\d+)")
+
+def natural_key(s):
+    # "build-10" 排在 "build-9" 之后
+    return tuple((0, int(part), "") if part.isdigit() else (1, 0, part) for part in NATURAL.split(s) if part)
+
+def semver_key(tag):
+    m = SEMVER.search(tag)
+    if not m:
+        return None
+    major, minor, patch, pre = m.groups()
+    # 正式版排在同版本号的预发布版之后
+    return (int(major), int(minor), int(patch), pre is None, natural_key(pre or ""))
+
+class Rule(object):
+    def __init__(self, name, pattern, keep=None, max_age=None, sort="build", build=None):
+        if sort not in SORTS:
+            raise ValueError(f"不支持的排序方式: {sort}")
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.keep = keep
+        self.max_age = max_age
+        self.sort = sort
+        self.build = re.compile(build or LAST_NUMBER)
+
+    def sort_key(self, tag, index, timestamp):
+        if self.sort == "build":
+            m = self.build.search(tag)
+            return int(m.group(1)) if m else None
+        if self.sort == "semver":
+            return semver_key(tag)
+        if self.sort == "natural":
+            return natural_key(tag)
+        if self.sort == "time":
+            return timestamp
+        # order: 后端返回顺序，越靠后越新
+        return index
+
+class Evaluation(object):
+    """
+    一次评估的结果
+        delete - 待删除标签，按从旧到新排列
+        keep   - 保留的标签
+        counts - {分类名: 标签数}，未匹配的计入 other
+    """
+    def __init__(self, names):
+        self.delete = []
+        self.keep = []
+        self.counts = dict.fromkeys(names, 0)
+
+class Policy(object):
+    def __init__(self, rules):
+        self.rules = [rule if isinstance(rule, Rule) else Rule(**rule) for rule in rules]
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "r", encoding="utf-8") as f:
+            if path.endswith((".yaml", ".yml")):
+                import yaml
+                return cls(yaml.safe_load(f))
+            return cls(json.load(f))
+
+    def classify(self, tag):
+        for rule in self.rules:
+            if rule.pattern.search(tag):
+                return rule
+        return None
+
+    def evaluate(self, tags, timestamps=None, now=None):
+        """
+        评估一个仓库的全部标签，一次分类加每类一次排序，O(n log n)
+            tags       - 标签名列表，顺序为后端返回顺序
+            timestamps - {tag: 推送时间 epoch 秒}，没有时间的后端可不传
+        """
+        timestamps = timestamps or {}
+        now = now or time.time()
+        result = Evaluation([rule.name for rule in self.rules] + ["other"])
+
+        groups = {rule.name: [] for rule in self.rules}
+        for index, tag in enumerate(tags):
+            rule = self.classify(tag)
+            if rule is None:
+                result.counts["other"] += 1
+                result.keep.append(tag)
+                continue
+            result.counts[rule.name] += 1
+            ts = timestamps.get(tag)
+            key = rule.sort_key(tag, index, ts)
+            if key is None or (rule.keep is None and rule.max_age is None):
+                result.keep.append(tag)
+                continue
+            groups[rule.name].append((key, tag, ts))
+
+        for rule in self.rules:
+            ranked = sorted(groups[rule.name], key=lambda item: item[0], reverse=True)
+            doomed = []
+            for rank, (key, tag, ts) in enumerate(ranked):
+                if rule.keep is not None and rank < rule.keep:
+                    result.keep.append(tag)
+                elif rule.max_age is not None and (ts is None or now - ts <= rule.max_age * 86400):
+                    # 时间未知时无法判断是否过期，按保留处理
+                    result.keep.append(tag)
+                else:
+                    doomed.append(tag)
+            doomed.reverse()
+            result.delete.extend(doomed)
+
+        return result
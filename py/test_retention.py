@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# coding=utf-8
+# retention.Policy.evaluate 的单元测试
+#   cd py && python3 -m unittest test_retention
+
+import unittest
+import retention
+
+# 与 acr.py / clean_nexus_image.py 中的默认策略一致
+ACR_BUILD = r"^(?:[^-]*-){2}(\d+)(?:-|$)"
+ACR_POLICY = [
+    {"name": "merge", "pattern": "merge", "keep": 30, "sort": "build", "build": ACR_BUILD},
+    {"name": "gray", "pattern": "gray", "keep": 30, "sort": "build", "build": ACR_BUILD},
+]
+NEXUS_POLICY = [
+    {"name": "debug", "pattern": "debug", "keep": 7, "sort": "order"},
+]
+
+class AcrPolicyTest(unittest.TestCase):
+    def setUp(self):
+        self.policy = retention.Policy(ACR_POLICY)
+
+    def test_keep_30_by_build_number(self):
+        # 接口返回顺序打乱，且构建号位数不同，必须按数值而不是字符串排序
+        tags = [f"app-merge-{i}" for i in (5, 100, 9, 40, 1)] + [f"app-merge-{i}" for i in range(41, 71)]
+        result = self.policy.evaluate(tags)
+
+        expected = sorted(int(t.split("-")[2]) for t in tags)[:-30]
+        self.assertEqual(result.delete, [f"app-merge-{i}" for i in expected])
+        self.assertEqual(len(result.keep), 30)
+        self.assertIn("app-merge-100", result.keep)
+        self.assertEqual(result.counts, {"merge": 35, "gray": 0, "other": 0})
+
+    def test_classes_are_ranked_separately(self):
+        tags = [f"app-merge-{i}" for i in range(31)] + [f"app-gray-{i}" for i in range(30)]
+        result = self.policy.evaluate(tags)
+        self.assertEqual(result.delete, ["app-merge-0"])
+
+    def test_non_numeric_third_field_is_kept(self):
+        tags = [f"app-merge-{i}" for i in range(40)] + ["app-merge-abc", "x-merge", "app-gray-3-fix1"]
+        result = self.policy.evaluate(tags)
+
+        self.assertEqual(result.delete, [f"app-merge-{i}" for i in range(10)])
+        self.assertIn("app-merge-abc", result.keep)
+        self.assertIn("x-merge", result.keep)
+        # 第三段是数字时带后缀也按构建号参与排序
+        self.assertIn("app-gray-3-fix1", result.keep)
+
+    def test_unmatched_tags_are_kept(self):
+        result = self.policy.evaluate(["latest", "v1.0.0"])
+        self.assertEqual(result.delete, [])
+        self.assertEqual(result.counts["other"], 2)
+
+class NexusPolicyTest(unittest.TestCase):
+    def test_last_7_in_api_order(self):
+        # order 按接口返回顺序，越靠后越新，与标签内容无关
+        debug = ["debug-b", "debug-z", "debug-a", "debug-10", "debug-2", "debug-x", "debug-c", "debug-y", "debug-1"]
+        tags = ["release"] + debug
+        result = retention.Policy(NEXUS_POLICY).evaluate(tags)
+
+        self.assertEqual(result.delete, debug[:-7])
+        self.assertEqual(sorted(result.keep), sorted(["release"] + debug[-7:]))
+
+    def test_fewer_than_keep(self):
+        result = retention.Policy(NEXUS_POLICY).evaluate(["debug-1", "debug-2"])
+        self.assertEqual(result.delete, [])
+
+class SortAndAgeTest(unittest.TestCase):
+    def test_semver_prerelease_before_release(self):
+        policy = retention.Policy([{"name": "release", "pattern": r"^v\d", "keep": 2, "sort": "semver"}])
+        tags = ["v1.10.0-rc.1", "v1.2.0", "v1.10.0", "v1.9.9", "v2.0.0-rc.2", "v2.0.0-rc.10"]
+        result = policy.evaluate(tags)
+
+        # 1.2.0 < 1.9.9 < 1.10.0-rc.1 < 1.10.0 < 2.0.0-rc.2 < 2.0.0-rc.10
+        self.assertEqual(result.delete, ["v1.2.0", "v1.9.9", "v1.10.0-rc.1", "v1.10.0"])
+        self.assertEqual(sorted(result.keep), ["v2.0.0-rc.10", "v2.0.0-rc.2"])
+
+    def test_natural_sort(self):
+        policy = retention.Policy([{"name": "b", "pattern": "^build", "keep": 1, "sort": "natural"}])
+        result = policy.evaluate(["build9", "build10", "build2"])
+        self.assertEqual(result.delete, ["build2", "build9"])
+
+    def test_keep_or_max_age(self):
+        day = 86400
+        now = 100 * day
+        policy = retention.Policy([{"name": "ci", "pattern": "^ci-", "keep": 1, "max_age": 7, "sort": "time"}])
+        timestamps = {"ci-new": now - day, "ci-recent": now - 3 * day, "ci-old": now - 30 * day}
+        result = policy.evaluate(["ci-old", "ci-recent", "ci-new", "ci-unknown"], timestamps, now)
+
+        # ci-new 靠 keep 保留，ci-recent 靠 max_age 保留，没有时间的标签不参与排序直接保留
+        self.assertEqual(result.delete, ["ci-old"])
+        self.assertEqual(sorted(result.keep), ["ci-new", "ci-recent", "ci-unknown"])
+
+    def test_no_keep_and_no_max_age_keeps_all(self):
+        policy = retention.Policy([{"name": "all", "pattern": ".", "sort": "order"}])
+        self.assertEqual(policy.evaluate(["a", "b"]).delete, [])
+
+    def test_unknown_sort_rejected(self):
+        with self.assertRaises(ValueError):
+            retention.Rule("x", "x", sort="random")
+
+if __name__ == "__main__":
+    unittest.main()